@@ -0,0 +1,142 @@
+import html
+
+import numpy as np
+import pandas as pd
+
+## Time estimates
+# The Priority field is a time estimate bucket; each one counts as a
+# typical length for that bucket when adding up booked minutes.
+PRIORITY_MINUTES = {"> 45 Minutes": 60, "15-45 Minutes": 30, "< 15 Minutes": 10}
+WORKLOAD_COLUMNS = ["tasks", "done", "minutes", "done minutes"]
+
+def _due_days(due):
+    # A column of due dates as datetime64 days; missing ones are NaT
+    due = due if pd.api.types.is_datetime64_any_dtype(due) else pd.to_datetime(due, errors="coerce")
+    return due.to_numpy(dtype="datetime64[D]")
+
+
+## Workload rollup
+# Per-day task count, done count and booked minutes (all of them and the
+# done ones), kept up to date as tasks change like the category rollup, so
+# the analytics never scan the task table. Tasks without a due date aren't
+# booked on any day.
+class WorkloadRollup:
+    def __init__(self, tasks=None):
+        # tasks: frame with Due Date, Priority and Completed columns, and
+        # optionally Count when a row stands for several tasks (a GROUP BY)
+        self.days = {}  # day number -> [tasks, done, minutes, done minutes]
+        if tasks is None or tasks.empty:
+            return
+        days = _due_days(tasks["Due Date"])
+        booked = ~np.isnat(days)
+        if not booked.any():
+            return
+        count = tasks["Count"].to_numpy(dtype=np.int64) if "Count" in tasks else np.ones(len(tasks), dtype=np.int64)
+        done = tasks["Completed"].fillna(False).astype(bool).to_numpy()
+        minutes = tasks["Priority"].map(PRIORITY_MINUTES).fillna(0).to_numpy(dtype=np.int64)
+        keys, slot = np.unique(days[booked].astype(np.int64), return_inverse=True)
+        count, done, minutes = count[booked], done[booked], minutes[booked]
+        totals = [
+            np.bincount(slot, weights=weights, minlength=len(keys)).round().astype(np.int64)
+            for weights in (count, count * done, count * minutes, count * minutes * done)
+        ]
+        self.days = {int(day): [int(n) for n in row] for day, *row in zip(keys, *totals)}
+
+    def state(self):
+        return {str(np.datetime64(day, "D")): totals for day, totals in self.days.items()}
+
+    def merge(self, state):
+        # Folds in another rollup's state(), e.g. one saved per partition
+        for day, totals in state.items():
+            day = int(np.datetime64(day, "D").astype(np.int64))
+            mine = self.days.setdefault(day, [0, 0, 0, 0])
+            for i, n in enumerate(totals):
+                mine[i] += n
+
+    def add(self, due, priority, completed, count=1):
+        day = _due_days(pd.Series([due]))[0]
+        if np.isnat(day):
+            return
+        day = int(day.astype(np.int64))
+        minutes = PRIORITY_MINUTES.get(priority, 0)
+        done = bool(completed)
+        totals = self.days.setdefault(day, [0, 0, 0, 0])
+        for i, n in enumerate((count, count * done, count * minutes, count * minutes * done)):
+            totals[i] += n
+        if not totals[0]:
+            del self.days[day]
+
+    def remove(self, due, priority, completed):
+        self.add(due, priority, completed, count=-1)
+
+    def set_completed(self, due, priority, was_completed, completed):
+        if bool(was_completed) == bool(completed):
+            return
+        self.remove(due, priority, was_completed)
+        self.add(due, priority, completed)
+
+    def first_day(self):
+        return np.datetime64(min(self.days), "D").astype(object) if self.days else None
+
+    def between(self, start, end):
+        # One row per day from start to end, days without tasks included
+        first = int(np.datetime64(start, "D").astype(np.int64))
+        counts = np.zeros(((end - start).days + 1, len(WORKLOAD_COLUMNS)), dtype=np.int64)
+        for day, totals in self.days.items():
+            if 0 <= day - first < len(counts):
+                counts[day - first] = totals
+        return workload_frame(start, end, counts)
+
+
+def workload_frame(start, end, counts):
+    return pd.DataFrame(counts, index=pd.date_range(start, end, freq="D", name="day"), columns=WORKLOAD_COLUMNS)
+
+
+## Summaries of a workload frame
+def by_week(days):
+    # Weeks start on Sunday, like the month calendar
+    return days.groupby(days.index.to_period("W-SAT").start_time.rename("week")).sum()
+
+def overdue(days, today):
+    # Open tasks due before today, and the minutes booked for them
+    late = days[days.index < pd.Timestamp(today)]
+    return int(late["tasks"].sum() - late["done"].sum()), int(late["minutes"].sum() - late["done minutes"].sum())
+
+def category_completion(categories, archived=()):
+    # Completion rate per category, from a store's category_overview() and
+    # its archived_categories()
+    table = pd.DataFrame(
+        [(cat.name, cat.total, cat.total - cat.open) for cat in [*categories, *archived]],
+        columns=["category", "tasks", "done"],
+    ).groupby("category").sum()
+    table["completion rate"] = (table["done"] / table["tasks"]).round(3)
+    return table
+
+
+## Year heatmap
+# One small square per day, weeks as columns, shaded by booked minutes
+# relative to the year's busiest day.
+HEAT_COLORS = ["#f0f0f0", "#FABC75", "#CE713B", "#B15E6C", "#832120"]
+
+HEATMAP_CSS = "<style>\n" + "\n".join([
+    ".todo-heat { border-collapse: separate; border-spacing: 2px; }",
+    ".todo-heat td { width: 12px; height: 12px; padding: 0; border-radius: 2px; border: none; }",
+    ".todo-heat th { font-weight: normal; font-size: 0.7em; text-align: left; padding-right: 4px; border: none; }",
+    *(f".todo-heat td.todo-h{i} {{ background-color: {c}; }}" for i, c in enumerate(HEAT_COLORS)),
+]) + "\n</style>"
+
+def render_heatmap(days):
+    minutes = days["minutes"].to_numpy()
+    levels = np.ceil(minutes / max(1, minutes.max()) * (len(HEAT_COLORS) - 1)).astype(int)
+    # Sunday-first rows, like the month calendar
+    rows = (days.index.dayofweek.to_numpy() + 1) % 7
+    columns = (np.arange(len(days)) + rows[0]) // 7
+    titles = days.index.strftime("%b %d") + ": " + days["tasks"].astype(str) + " task(s), " \
+        + days["minutes"].astype(str) + " min"
+    grid = [["<td></td>"] * (columns[-1] + 1) for _ in range(7)]
+    for row, column, level, title in zip(rows, columns, levels, titles):
+        grid[row][column] = f"<td class='todo-h{level}' title='{html.escape(title)}'></td>"
+    labels = ["Sun", "", "Tue", "", "Thu", "", "Sat"]
+    return "<table class='todo-heat'>" + "".join(
+        f"<tr><th>{label}</th>{''.join(cells)}</tr>" for label, cells in zip(labels, grid)
+    ) + "</table>"
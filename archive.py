@@ -0,0 +1,186 @@
+import argparse
+import gzip
+import os
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from analytics import WorkloadRollup
+from search import SearchIndex
+from storage import (
+    DATE_FORMAT, STORAGE_BACKENDS, TASK_COLUMNS, empty_tasks, file_lock, file_stamp, get_storage, stored_user_ids,
+    to_app_format,
+)
+from task_store import CategoryRollup, CategorySummary, data_versions
+
+# Completed tasks due before this are all archived together
+ARCHIVE_EPOCH = date(1900, 1, 1)
+
+## Archive files
+# user_tasks/archive_<user_id>.csv.gz holds a user's archived tasks. Each
+# archival run appends one gzip member (concatenated members read back as a
+# single stream), so archiving never rewrites what is already there. The
+# file is only read when someone asks for archived tasks, then kept parsed,
+# with its own search index and workload and category rollups, until the
+# file changes. Our own appends update the parsed tasks and the rollups in
+# place instead of reading the file again.
+class TaskArchive:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.version = next(data_versions)
+        self._seen = None
+        self._tasks = None
+        self._search = None
+        self._workload = None
+        self._categories = None
+
+    def changed(self):
+        return file_stamp(self.path) != self._seen
+
+    def _load(self):
+        with self.lock:
+            if self._tasks is not None and not self.changed():
+                return self._tasks
+            with file_lock(self.path):
+                tasks = pd.read_csv(self.path, compression="gzip", dtype={"ID": object}) if self.path.exists() else empty_tasks()
+                self._seen = file_stamp(self.path)
+            self._tasks = _parsed(tasks)
+            self._search = None
+            self._workload = WorkloadRollup(self._tasks)
+            self._categories = CategoryRollup(self._tasks)
+            self.version = next(data_versions)
+            return self._tasks
+
+    def tasks_between(self, start, end):
+        tasks = self._load()
+        due = tasks["Due Date"]
+        return tasks[(due >= pd.Timestamp(start)) & (due <= pd.Timestamp(end))]
+
+    def search(self, query, limit=20):
+        with self.lock:
+            tasks = self._load()
+            if self._search is None:
+                self._search = SearchIndex(tasks)
+            return self._search.search(query, limit)
+
+    def workload_between(self, start, end):
+        with self.lock:
+            self._load()
+            return self._workload.between(start, end)
+
+    def category_overview(self):
+        # Counts only; archived names are found through search()
+        with self.lock:
+            self._load()
+            return [CategorySummary(cat.name, cat.total, cat.open, []) for cat in self._categories.overview()]
+
+    def append(self, tasks):
+        with self.lock, file_lock(self.path):
+            up_to_date = self._tasks is not None and not self.changed()
+            header = not self.path.exists()
+            with open(self.path, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+                    f.write(to_app_format(tasks.reindex(columns=TASK_COLUMNS)).to_csv(index=False, header=header).encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+            if up_to_date:
+                new = _parsed(to_app_format(tasks.reindex(columns=TASK_COLUMNS)))
+                new = new[~new.index.isin(self._tasks.index)]
+                self._tasks = pd.concat([self._tasks, new]).sort_values("Due Date", kind="stable")
+                self._workload.merge(WorkloadRollup(new).state())
+                self._categories.merge(CategoryRollup(new).state())
+                self._search = None
+                self._seen = file_stamp(self.path)
+            else:
+                # Parsed lazily again on the next read
+                self._tasks = None
+            self.version = next(data_versions)
+
+def _parsed(tasks):
+    # A run interrupted between archiving and deleting archives again
+    tasks = tasks.drop_duplicates("ID", keep="last")
+    tasks["Due Date"] = pd.to_datetime(tasks["Due Date"], format=DATE_FORMAT, errors="coerce")
+    tasks["Completed"] = tasks["Completed"].astype(bool)
+    return tasks.sort_values("Due Date", kind="stable").set_axis(tasks["ID"].tolist())
+
+
+## Store with an archive
+# Wraps a user's task store and archive. Reads and changes go to the live
+# store, which only holds open tasks and recent history; archived tasks are
+# read through archived_between() and search_archived(). The workload counts
+# archived tasks too, and archived_categories() has their per-category
+# totals.
+class ArchivedStore:
+    def __init__(self, store, archive):
+        self.store = store
+        self.archive = archive
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def version(self):
+        return max(self.store.version, self.archive.version)
+
+    def archive_before(self, day):
+        # Moves completed tasks due before day into the archive: appended
+        # there first, then deleted here in one batch. Returns how many moved.
+        with self.store.lock:
+            old = self.store.completed_between(ARCHIVE_EPOCH, day - timedelta(days=1))
+            if old.empty:
+                return 0
+            self.archive.append(old)
+            self.store.delete_many(old.index.tolist())
+            return len(old)
+
+    def archived_between(self, start, end):
+        return self.archive.tasks_between(start, end)
+
+    def workload_between(self, start, end):
+        return self.store.workload_between(start, end) + self.archive.workload_between(start, end)
+
+    def archived_categories(self):
+        return self.archive.category_overview()
+
+    def search_archived(self, query, limit=20):
+        return self.archive.search(query, limit)
+
+
+class ArchivedStorage:
+    # Wraps a storage backend so open() returns ArchivedStores, archiving
+    # completed tasks older than max_age_days first (0 turns that off)
+    def __init__(self, backend, folder, max_age_days=90):
+        self.backend = backend
+        self.folder = Path(folder)
+        self.max_age_days = max_age_days
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def archive_path(self, user_id):
+        return self.folder / f"archive_{user_id}.csv.gz"
+
+    def open(self, user_id):
+        store = ArchivedStore(self.backend.open(user_id), TaskArchive(self.archive_path(user_id)))
+        if self.max_age_days:
+            store.archive_before(date.today() - timedelta(days=self.max_age_days))
+        return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive every user's old completed tasks")
+    parser.add_argument("--days", type=int, default=90, help="archive completed tasks due more than this many days ago")
+    parser.add_argument("--backend", default=os.environ.get("TODO_STORAGE", "csv"), choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--folder", default="user_tasks")
+    args = parser.parse_args()
+
+    storage = ArchivedStorage(get_storage(args.backend, args.folder), args.folder, max_age_days=0)
+    cutoff = date.today() - timedelta(days=args.days)
+    moved = {user_id: storage.open(user_id).archive_before(cutoff) for user_id in sorted(stored_user_ids(args.folder))}
+    print(f"Archived {sum(moved.values())} task(s) for {sum(1 for n in moved.values() if n)} user(s)")
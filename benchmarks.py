@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analytics import render_heatmap
+from calendar_view import render_month, priority_colors
+from storage import DATE_FORMAT, STORAGE_BACKENDS, get_storage
+
+APP_FILE = Path(__file__).with_name("to_do.py")
+USER_ID = "bench_user"
+
+## Synthetic data
+def make_tasks(rows, categories=20, spread_days=365, seed=0):
+    # Due dates are spread around today, so the app's default month has tasks
+    rng = np.random.default_rng(seed)
+    start = date.today() - timedelta(days=spread_days // 2)
+    due = np.datetime64(start) + rng.integers(0, spread_days, rows).astype("timedelta64[D]")
+    return pd.DataFrame({
+        "Task": np.char.add("task ", np.arange(rows).astype(str)).astype(object),
+        "Category": np.char.add("cat ", rng.integers(0, categories, rows).astype(str)).astype(object),
+        "Due Date": pd.to_datetime(due).strftime(DATE_FORMAT).astype(object),
+        "Priority": rng.choice(list(priority_colors), rows).astype(object),
+        "Completed": rng.random(rows) < 0.5,
+        "Description": "",
+    })
+
+
+## Timing
+def time_call(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"min_s": min(times), "median_s": statistics.median(times), "repeat": repeat}
+
+def bench_hot_paths(backend, tasks, folder, repeat):
+    # The pieces of a rerun, run directly against the storage and store code
+    storage = get_storage(backend, folder)
+    busiest_day = pd.to_datetime(tasks["Due Date"], format=DATE_FORMAT).dt.date.mode()[0]
+
+    results = {"save_tasks": time_call(lambda: storage.save(USER_ID, tasks), repeat)}
+    results["load_tasks"] = time_call(lambda: storage.load(USER_ID), repeat)
+    results["open_store"] = time_call(lambda: storage.open(USER_ID), repeat)
+    store = storage.open(USER_ID)
+    results["calendar_grid"] = time_call(
+        lambda: render_month(store, busiest_day.year, busiest_day.month), repeat
+    )
+    results["category_overview"] = time_call(store.category_overview, repeat)
+    results["selected_day"] = time_call(lambda: store.tasks_on(busiest_day), repeat)
+    year = busiest_day.year
+    results["workload_year"] = time_call(
+        lambda: render_heatmap(store.workload_between(date(year, 1, 1), date(year, 12, 31))), repeat
+    )
+    return results
+
+def bench_app_reruns(backend, tasks, folder, reruns):
+    # Scripted reruns of the real script through streamlit's AppTest
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    # The app's caches are process-wide; start each run from a cold server
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    get_storage(backend, folder / "user_tasks").save(USER_ID, tasks)
+    user_name, secret_key = USER_ID.rsplit("_", 1)
+    old_cwd, old_backend = os.getcwd(), os.environ.get("TODO_STORAGE")
+    os.chdir(folder)
+    os.environ["TODO_STORAGE"] = backend
+    try:
+        at = AppTest.from_file(str(APP_FILE), default_timeout=600).run()
+        at.text_input[0].input(user_name)
+        at.text_input[1].input(secret_key)
+        at.button[0].click()
+        results = {"app_login": time_call(at.run, 1)}
+        results["app_rerun"] = time_call(at.run, reruns)
+        next_month = next(b for b in at.button if b.label == "→")
+        results["app_next_month"] = time_call(lambda: next_month.click().run(), reruns)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return results
+    finally:
+        os.chdir(old_cwd)
+        if old_backend is None:
+            os.environ.pop("TODO_STORAGE", None)
+        else:
+            os.environ["TODO_STORAGE"] = old_backend
+
+
+## Comparing runs
+def compare(old_file, results):
+    key = lambda r: (r["backend"], r["rows"], r["categories"], r["spread_days"], r["case"])
+    old = {key(r): r for r in json.loads(Path(old_file).read_text())["results"]}
+    print(f"{'case':<45}{'old (ms)':>12}{'new (ms)':>12}{'ratio':>8}")
+    for r in results:
+        if key(r) in old:
+            before, after = old[key(r)]["median_s"], r["median_s"]
+            label = "/".join(str(k) for k in key(r))
+            print(f"{label:<45}{before * 1e3:>12.2f}{after * 1e3:>12.2f}{after / before:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the to-do app's rerun hot paths on synthetic data")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--categories", type=int, nargs="+", default=[20])
+    parser.add_argument("--spread-days", type=int, nargs="+", default=[365])
+    parser.add_argument("--backends", nargs="+", default=sorted(STORAGE_BACKENDS), choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--app-reruns", type=int, default=5)
+    parser.add_argument("--app-max-rows", type=int, default=100_000,
+                        help="skip the AppTest reruns above this many rows (0 to skip them entirely)")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        for categories in args.categories:
+            for spread_days in args.spread_days:
+                tasks = make_tasks(rows, categories, spread_days)
+                for backend in args.backends:
+                    with tempfile.TemporaryDirectory() as tmp:
+                        timings = bench_hot_paths(backend, tasks, Path(tmp) / "direct", args.repeat)
+                        if 0 < rows <= args.app_max_rows:
+                            timings.update(bench_app_reruns(backend, tasks, Path(tmp), args.app_reruns))
+                    for case, timing in timings.items():
+                        results.append({"backend": backend, "rows": rows, "categories": categories,
+                                        "spread_days": spread_days, "case": case, **timing})
+                        print(f"{backend:<8}{rows:>9} rows {categories:>5} cats {spread_days:>5} days  "
+                              f"{case:<18}{timing['median_s'] * 1e3:>10.2f} ms")
+
+    Path(args.out).write_text(json.dumps({
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": results,
+    }, indent=2))
+    print(f"Wrote {len(results)} timings to {args.out}")
+    if args.compare:
+        compare(args.compare, results)
@@ -0,0 +1,65 @@
+import calendar
+import html
+from datetime import date
+
+import pandas as pd
+
+WEEKDAYS = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+
+## Colors for Task Time
+priority_colors = {
+    "> 45 Minutes": "#832120",
+    "15-45 Minutes": "#CE713B",
+    "< 15 Minutes": "#FABC75"
+}
+priority_classes = {p: f"todo-p{i}" for i, p in enumerate(priority_colors)}
+
+## Calendar Styling
+# Shared classes for the month grid, so each task is a bare <div class=...>
+# instead of carrying its own inline style.
+CALENDAR_CSS = "<style>\n" + "\n".join([
+    ".todo-cal { border-collapse: collapse; width: 100%; text-align: center; table-layout: fixed; }",
+    ".todo-cal td { vertical-align: top; padding: 2px; }",
+    ".todo-cal td.todo-pad { background-color: #f0f0f0; color: #999; }",
+    ".todo-task { background-color: #ffffff; color: white; margin: 2px; padding: 2px; border-radius: 4px; word-break: break-word; }",
+    *(f".todo-task.{priority_classes[p]} {{ background-color: {c}; }}" for p, c in priority_colors.items()),
+    ".todo-task.todo-done { background-color: #d3d3d3; color: #888; text-decoration: line-through; }",
+]) + "\n</style>"
+
+HEADER_ROW = "<tr>" + "".join(f"<th>{day}</th>" for day in WEEKDAYS) + "</tr>"
+
+
+def task_divs_by_day(month_tasks):
+    # One vectorized pass: build every task's <div>, then join them per day
+    if month_tasks.empty:
+        return {}
+    due = month_tasks["Due Date"].dt.date
+    done = month_tasks["Completed"].fillna(False).astype(bool)
+    classes = month_tasks["Priority"].map(priority_classes).fillna("").where(~done, "todo-done")
+    names = month_tasks["Task"].astype(str).map(html.escape)
+    divs = '<div class="todo-task ' + classes + '">' + names + "</div>"
+    return divs.groupby(due.to_numpy(), sort=False).agg("".join).to_dict()
+
+
+def render_month(task_store, year, month, include_archived=False):
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    month_tasks = task_store.tasks_between(first, last)
+    if include_archived:
+        archived = task_store.archived_between(first, last)
+        if len(archived):
+            month_tasks = pd.concat([month_tasks, archived]) if len(month_tasks) else archived
+    cells_by_day = task_divs_by_day(month_tasks)
+
+    rows = [HEADER_ROW]
+    for week in calendar.Calendar(firstweekday=6).monthdatescalendar(year, month):
+        cells = []
+        for day in week:
+            if day.month != month:
+                cells.append("<td class='todo-pad'> </td>")
+            elif day in cells_by_day:
+                cells.append(f"<td><strong>{day.day}</strong><br>{cells_by_day[day]}</td>")
+            else:
+                cells.append(f"<td>{day.day}</td>")
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    return "<table border='1' class='todo-cal'>" + "".join(rows) + "</table>"
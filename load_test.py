@@ -0,0 +1,278 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import APP_FILE, make_tasks
+from storage import STORAGE_BACKENDS, get_storage
+from users import UserRegistry
+
+PASSWORD = "load-test"
+# Relative weights of the actions a simulated user takes after logging in
+DEFAULT_MIX = {"add": 3, "toggle": 3, "delete": 1, "month": 3, "rerun": 1}
+
+## Process counters
+# Linux only (/proc); elsewhere they come back as None and are left out.
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def io_counters():
+    # Bytes passed to read/write calls (rchar/wchar) and bytes that reached
+    # the disk (read_bytes/write_bytes)
+    try:
+        with open("/proc/self/io") as f:
+            return {name: int(value) for name, value in (line.split(": ") for line in f)}
+    except (OSError, ValueError):
+        return None
+
+
+## Simulated sessions
+# Every session is an AppTest of the real script with its own session
+# state; the sessions in one process share the app's caches, as the
+# sessions of one server process do. AppTest is not thread-safe, so a
+# process takes its sessions' turns one at a time, in random order, and
+# real concurrency comes from running several app processes on the same
+# data folder (or the same task service).
+def log_in(at, user_name):
+    at.text_input[0].input(user_name)
+    at.text_input[1].input(PASSWORD)
+    at.button[0].click()
+
+def page_complete(at):
+    # After a fragment rerun AppTest only holds the fragments that ran; a
+    # browser would still show the rest of the page
+    keys = {w.key for w in (*at.text_input, *at.date_input)}
+    return {"new_task_name", "selected_day"} <= keys and any(b.label == "→" for b in at.button)
+
+def act(at, action, rng, step):
+    # Sets up one interaction and returns what it actually was: a toggle or
+    # delete with nothing on screen is a plain rerun
+    if action == "add":
+        at.text_input(key="new_task_name").input(f"load task {step}")
+        next(b for b in at.button if b.label == "Add task").click()
+    elif action == "toggle" and len(at.checkbox):
+        box = rng.choice(list(at.checkbox))
+        box.set_value(not box.value)
+    elif action == "delete" and any(b.label == "X" for b in at.button):
+        rng.choice([b for b in at.button if b.label == "X"]).click()
+    elif action == "month":
+        label = rng.choice(["←", "→"])
+        next(b for b in at.button if b.label == label).click()
+    else:
+        action = "rerun"
+    return action
+
+def run_worker(worker, folder, user_names, actions, mix, seed, start, results):
+    # One app process: logs its sessions in, waits for the others, then
+    # plays actions turns across them and reports the timings
+    try:
+        results.put(_play(worker, folder, user_names, actions, mix, seed, start))
+    except Exception:
+        # Don't leave the other processes waiting at the start line
+        start.abort()
+        results.put({"failed": traceback.format_exc()})
+
+def _play(worker, folder, user_names, actions, mix, seed, start):
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(folder)
+    rng = random.Random(seed)
+    timings = {}
+    errors = []
+
+    def timed_run(at, action):
+        t0 = time.perf_counter()
+        at.run()
+        timings.setdefault(action, []).append(time.perf_counter() - t0)
+        errors.extend(e.message for e in at.exception)
+        return time.perf_counter() - t0
+
+    sessions = []
+    memory = [rss_bytes()]
+    for user_name in user_names:
+        at = AppTest.from_file(str(APP_FILE), default_timeout=600)
+        timed_run(at, "open")
+        log_in(at, user_name)
+        timed_run(at, "login")
+        sessions.append(at)
+        memory.append(rss_bytes())
+
+    start.wait()
+    io_before, busy, redraws = io_counters(), 0.0, 0
+    names, weights = list(mix), list(mix.values())
+    for step in range(actions * len(sessions)):
+        at = rng.choice(sessions)
+        if not page_complete(at):
+            # Full redraw, not timed: the browser already has the page
+            at.run()
+            redraws += 1
+        action = act(at, rng.choices(names, weights)[0], rng, f"{worker}-{step}")
+        busy += timed_run(at, action)
+    io_after = io_counters()
+    return {
+        "timings": timings,
+        "errors": errors,
+        "busy": busy,
+        "played": actions * len(sessions),
+        "runs": actions * len(sessions) + redraws,
+        "memory": memory + [rss_bytes()],
+        "io": None if io_before is None else {k: io_after[k] - io_before[k] for k in io_before},
+    }
+
+
+## Test setup
+def seed_users(folder, backend, users, tasks_per_user, spread_days, service_url=None):
+    # Registers load_user_<i> in the app's registry and gives each one a
+    # task list, due around today so the day list has something to tick off
+    registry = UserRegistry(folder / "user_tasks" / "users.json")
+    if service_url:
+        from task_service import RemoteStorage
+        storage = RemoteStorage(service_url)
+    else:
+        storage = get_storage(backend, folder / "user_tasks")
+    names = []
+    for i in range(users):
+        name = f"load_user_{i}"
+        key = registry.login(name, PASSWORD)
+        if tasks_per_user:
+            tasks = make_tasks(tasks_per_user, spread_days=spread_days, seed=i)
+            if service_url:
+                storage.open(key).add_many(tasks)
+            else:
+                storage.save(key, tasks)
+        names.append(name)
+    return names
+
+def folder_size(folder):
+    return sum(path.stat().st_size for path in Path(folder).rglob("*") if path.is_file())
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1e3, 2) if values else None
+
+def run_level(backend, sessions, processes, args, mix):
+    # One point of the scaling curve: sessions spread over processes
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp)
+        users = seed_users(
+            folder, backend, args.users or sessions, args.tasks, args.spread_days, args.service_url
+        )
+        ctx = multiprocessing.get_context("spawn")
+        env = {"TODO_STORAGE": backend, "TODO_BACKGROUND_WRITES": "1" if args.background_writes else "0"}
+        # Streamlit's own warnings would otherwise count as written bytes
+        env["STREAMLIT_LOGGER_LEVEL"] = "error"
+        if args.service_url:
+            env["TODO_SERVICE_URL"] = args.service_url
+        os.environ.update(env)
+        assigned = [[users[i % len(users)] for i in range(w, sessions, processes)] for w in range(min(processes, sessions))]
+        start, results = ctx.Barrier(len(assigned)), ctx.Queue()
+        workers = [
+            ctx.Process(target=run_worker, args=(w, folder, names, args.actions, mix, args.seed + w, start, results))
+            for w, names in enumerate(assigned)
+        ]
+        for worker in workers:
+            worker.start()
+        reports = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        failed = [r["failed"] for r in reports if "failed" in r]
+        if failed:
+            raise RuntimeError(f"A load test process failed:\n{failed[0]}")
+        data_bytes = folder_size(folder / "user_tasks")
+
+    timings = {}
+    for report in reports:
+        for action, values in report["timings"].items():
+            timings.setdefault(action, []).extend(values)
+    played = [t for action, values in timings.items() if action not in ("open", "login") for t in values]
+    runs = sum(r["runs"] for r in reports)
+    # memory: before any session, after each login, at the end
+    per_session = [
+        (r["memory"][-2] - r["memory"][1]) / (len(r["memory"]) - 3)
+        for r in reports if len(r["memory"]) > 3 and None not in r["memory"]
+    ]
+    io = [r["io"] for r in reports if r["io"] is not None]
+    result = {
+        "backend": "service" if args.service_url else backend,
+        "sessions": sessions,
+        "processes": len(workers),
+        "reruns": len(played),
+        "errors": sum(len(r["errors"]) for r in reports),
+        "first_errors": [e for r in reports for e in r["errors"]][:3],
+        # What the processes get through together while busy with reruns
+        "reruns_per_s": round(sum(r["played"] / r["busy"] for r in reports if r["busy"]), 2),
+        "p50_ms": percentile_ms(played, 50),
+        "p99_ms": percentile_ms(played, 99),
+        "actions": {
+            action: {"count": len(values), "p50_ms": percentile_ms(values, 50), "p99_ms": percentile_ms(values, 99)}
+            for action, values in sorted(timings.items())
+        },
+        # Growth per extra logged-in session; the first one also sets up the app
+        "memory_per_session_mb": round(float(np.mean(per_session)) / 2**20, 2) if per_session else None,
+        "process_memory_mb": [round(r["memory"][-1] / 2**20, 1) for r in reports if r["memory"][-1]],
+        "data_bytes": data_bytes,
+    }
+    if io:
+        total = {k: sum(counters[k] for counters in io) for k in io[0]}
+        # Per script run, including the untimed redraws
+        result["written_kb_per_rerun"] = round(total["wchar"] / runs / 1024, 2)
+        result["disk_write_kb_per_rerun"] = round(total["write_bytes"] / runs / 1024, 2)
+        result["read_kb_per_rerun"] = round(total["rchar"] / runs / 1024, 2)
+    return result
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or "").split(",")):
+        action, weight = part.split("=")
+        if action not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown action {action!r} in --mix, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[action] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive many simulated sessions against the app and report latency, memory and I/O")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 25], help="concurrent sessions, one run per value")
+    parser.add_argument("--processes", type=int, default=1, help="app processes sharing the data, sessions are split over them")
+    parser.add_argument("--actions", type=int, default=20, help="actions per session after logging in")
+    parser.add_argument("--users", type=int, default=0, help="distinct users to log in as (default: one per session)")
+    parser.add_argument("--tasks", type=int, default=500, help="tasks each user starts with")
+    parser.add_argument("--spread-days", type=int, default=60, help="their due dates are spread over this many days around today")
+    parser.add_argument("--mix", help="action weights, e.g. add=3,toggle=3,delete=1,month=3,rerun=1")
+    parser.add_argument("--backends", nargs="+", default=["csv"], choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--background-writes", action="store_true")
+    parser.add_argument("--service-url", help="run against a task_service.py instead of local files (--backends is ignored)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="load_test_results.json")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    results = []
+    for backend in ([None] if args.service_url else args.backends):
+        for sessions in args.sessions:
+            r = run_level(backend or "csv", sessions, args.processes, args, mix)
+            results.append(r)
+            print(f"{r['backend']:<12}{r['sessions']:>5} sessions {r['processes']:>3} procs  "
+                  f"p50 {r['p50_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  {r['reruns_per_s']:>7} reruns/s  "
+                  f"{r['memory_per_session_mb']} MB/session  {r.get('written_kb_per_rerun')} KB written/rerun  "
+                  f"{r['errors']} errors")
+
+    Path(args.out).write_text(json.dumps({
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "mix": mix,
+        "actions_per_session": args.actions,
+        "tasks_per_user": args.tasks,
+        "results": results,
+    }, indent=2))
+    print(f"Wrote {len(results)} load levels to {args.out}")
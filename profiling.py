@@ -0,0 +1,59 @@
+import cProfile
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("to_do.timing")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+## Per-rerun section timer
+# The script calls lap(name) at the end of each section; a lap is the time
+# since the previous one. When disabled, lap() returns straight away, so the
+# calls can stay in the script at next to no cost.
+class RerunTimer:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.laps = []
+        self.profiler = None
+        if enabled:
+            self._last = time.perf_counter()
+
+    def lap(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.laps.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.laps)
+
+    def log(self, **context):
+        # One structured line per rerun, for grepping or shipping to a log store
+        logger.info(json.dumps({
+            "event": "rerun_timing",
+            **context,
+            "total_ms": round(self.total() * 1e3, 3),
+            "sections_ms": {name: round(seconds * 1e3, 3) for name, seconds in self.laps},
+        }))
+
+    ## cProfile capture
+    def start_profile(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self, folder):
+        self.profiler.disable()
+        folder = Path(folder)
+        folder.mkdir(exist_ok=True)
+        path = folder / f"rerun_{datetime.now():%Y%m%d_%H%M%S_%f}.prof"
+        self.profiler.dump_stats(path)
+        self.profiler = None
+        return path
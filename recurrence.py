@@ -0,0 +1,347 @@
+import calendar
+import json
+import os
+import threading
+from collections.abc import Sequence
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from analytics import WorkloadRollup
+from search import SearchIndex, merge_hits
+from storage import DATE_FORMAT, TASK_COLUMNS, _write_durably, empty_tasks, file_lock, file_stamp
+from task_store import CategoryRollup, CategorySummary, data_versions, new_task_id
+
+## Recurrence rules
+# A subset of iCalendar RRULE: FREQ=DAILY|WEEKLY|MONTHLY|YEARLY with optional
+# INTERVAL, BYDAY (weekly), BYMONTHDAY (monthly), COUNT and UNTIL. Dates are
+# generated period by period, starting from the first period that can reach
+# the window asked for, so expanding a month costs the same no matter how
+# long the rule has been running.
+WEEKDAY_CODES = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+REPEAT_PRESETS = {"Daily": "FREQ=DAILY", "Weekly": "FREQ=WEEKLY", "Monthly": "FREQ=MONTHLY"}
+
+class Recurrence:
+    def __init__(self, rrule, start):
+        parts = dict(part.split("=", 1) for part in rrule.upper().replace("RRULE:", "").split(";") if part)
+        self.freq = parts.get("FREQ")
+        if self.freq not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+            raise ValueError(f"Unsupported or missing FREQ in {rrule!r}")
+        self.start = start
+        self.interval = int(parts.get("INTERVAL", 1))
+        self.count = int(parts["COUNT"]) if "COUNT" in parts else None
+        self.until = pd.to_datetime(parts["UNTIL"][:8], format="%Y%m%d").date() if "UNTIL" in parts else None
+        self.weekdays = sorted(WEEKDAY_CODES.index(day[-2:]) for day in parts["BYDAY"].split(",")) \
+            if "BYDAY" in parts else [start.weekday()]
+        self.month_day = int(parts.get("BYMONTHDAY", start.day))
+        if self.interval < 1:
+            raise ValueError(f"INTERVAL must be positive in {rrule!r}")
+
+    def _period(self, k):
+        # (first day of the k-th period, dates the rule falls on in it)
+        n = self.interval * k
+        if self.freq == "DAILY":
+            day = self.start + timedelta(days=n)
+            return day, [day]
+        if self.freq == "WEEKLY":
+            monday = self.start - timedelta(days=self.start.weekday()) + timedelta(weeks=n)
+            return monday, [monday + timedelta(days=d) for d in self.weekdays]
+        if self.freq == "MONTHLY":
+            year, month = divmod(self.start.month - 1 + n, 12)
+            year += self.start.year
+            first = date(year, month + 1, 1)
+            fits = self.month_day <= calendar.monthrange(year, month + 1)[1]
+            return first, [first.replace(day=self.month_day)] if fits else []
+        year = self.start.year + n
+        fits = self.start.month != 2 or self.start.day != 29 or calendar.isleap(year)
+        return date(year, 1, 1), [date(year, self.start.month, self.start.day)] if fits else []
+
+    def _first_period(self, day):
+        # Earliest period that can hold a date on or after day
+        if self.freq == "DAILY":
+            k = -(-(day - self.start).days // self.interval)
+        elif self.freq == "WEEKLY":
+            monday = self.start - timedelta(days=self.start.weekday())
+            k = (day - monday).days // (7 * self.interval)
+        elif self.freq == "MONTHLY":
+            k = ((day.year - self.start.year) * 12 + day.month - self.start.month) // self.interval
+        else:
+            k = (day.year - self.start.year) // self.interval
+        return max(0, k)
+
+    def between(self, start, end):
+        # Occurrence dates in [start, end]. COUNT numbers occurrences from the
+        # rule's start, so those rules are walked from their first period.
+        end = min(end, self.until) if self.until else end
+        k = 0 if self.count is not None else self._first_period(start)
+        seen = 0
+        while True:
+            period_start, days = self._period(k)
+            if period_start > end:
+                return
+            for day in days:
+                if day < self.start:
+                    continue
+                if day > end or (self.count is not None and seen >= self.count):
+                    return
+                seen += 1
+                if day >= start:
+                    yield day
+            k += 1
+
+
+## Rule files
+# user_tasks/recurring_<user_id>.json holds a user's rules, one JSON object
+# each with the task fields, its start date, the RRULE and the per-occurrence
+# overrides ({"YYYY-MM-DD": {"Completed": true}} or {"deleted": true}). Only
+# the rules are stored, never their occurrences. Changes re-read the file
+# under its lock, so concurrent writers don't drop each other's rules.
+class RuleBook:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self._load()
+
+    def _read(self):
+        return json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else []
+
+    def _load(self):
+        with file_lock(self.path):
+            self._set(self._read())
+
+    def _set(self, rules):
+        self.rules = {rule["ID"]: rule for rule in rules}
+        self.recurrences = {
+            rule["ID"]: Recurrence(rule["RRULE"], pd.to_datetime(rule["Start"], format=DATE_FORMAT).date())
+            for rule in rules
+        }
+        self.search_index = SearchIndex(pd.DataFrame(
+            [{**rule, "Due Date": pd.to_datetime(rule["Start"], format=DATE_FORMAT), "Completed": False} for rule in rules],
+            columns=TASK_COLUMNS,
+        ))
+        self._seen = file_stamp(self.path)
+        self.version = next(data_versions)
+
+    def changed(self):
+        return file_stamp(self.path) != self._seen
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _change(self, update):
+        with self.lock, file_lock(self.path):
+            rules = {rule["ID"]: rule for rule in self._read()}
+            update(rules)
+            tmp = self.path.with_suffix(".json.tmp")
+            _write_durably(tmp, json.dumps(list(rules.values())))
+            os.replace(tmp, self.path)
+            self._set(list(rules.values()))
+
+    ## Changes
+    def add(self, task, rrule):
+        # task is a sidebar task dict; its due date is the first occurrence
+        rule = {col: task.get(col) for col in ("Task", "Category", "Priority", "Description")}
+        rule.update(ID=new_task_id(), Start=task["Due Date"], RRULE=rrule, Overrides={})
+        Recurrence(rrule, pd.to_datetime(rule["Start"], format=DATE_FORMAT).date())  # validate first
+        self._change(lambda rules: rules.__setitem__(rule["ID"], rule))
+        return rule["ID"]
+
+    def override(self, rule_id, day, **fields):
+        def update(rules):
+            if rule_id in rules:
+                rules[rule_id]["Overrides"].setdefault(day.isoformat(), {}).update(fields)
+        self._change(update)
+
+    def remove(self, rule_id):
+        self._change(lambda rules: rules.pop(rule_id, None))
+
+    ## Expansion
+    def tasks_between(self, start, end):
+        # Frame shaped like a store's, one row per occurrence, keyed
+        # "<rule id>@<YYYY-MM-DD>"
+        with self.lock:
+            rows = []
+            for rule_id, recurrence in self.recurrences.items():
+                rule = self.rules[rule_id]
+                for day in recurrence.between(start, end):
+                    override = rule["Overrides"].get(day.isoformat(), {})
+                    if override.get("deleted"):
+                        continue
+                    rows.append({
+                        **{col: rule.get(col) for col in ("Task", "Category", "Priority", "Description")},
+                        "Due Date": day,
+                        "Completed": bool(override.get("Completed", False)),
+                        "ID": occurrence_key(rule_id, day),
+                    })
+        if not rows:
+            return empty_tasks()
+        tasks = pd.DataFrame(rows, columns=TASK_COLUMNS)
+        tasks["Due Date"] = pd.to_datetime(tasks["Due Date"])
+        tasks = tasks.sort_values("Due Date", kind="stable")
+        return tasks.set_axis(tasks["ID"].tolist())
+
+    def rollup(self):
+        # Each rule counts once in its category
+        rollup = CategoryRollup()
+        for rule in self.rules.values():
+            rollup.add(rule.get("Category"), rule["Task"], False)
+        return rollup
+
+
+def occurrence_key(rule_id, day):
+    return f"{rule_id}@{day.isoformat()}"
+
+def split_occurrence_key(key, rule_ids):
+    # (rule id, date) for an occurrence of one of rule_ids, None for any
+    # other row key; imported tasks can have IDs like "<uid>@example.com"
+    if not isinstance(key, str) or "@" not in key:
+        return None
+    rule_id, day = key.split("@", 1)
+    if rule_id not in rule_ids:
+        return None
+    try:
+        return rule_id, date.fromisoformat(day)
+    except ValueError:
+        return None
+
+
+class RepeatingNames(Sequence):
+    # A category's one-off task names followed by its rules' names, marked as
+    # repeating, read from both lists on access
+    def __init__(self, own, repeats):
+        self.own, self.repeats = own, repeats
+
+    def __len__(self):
+        return len(self.own) + len(self.repeats)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < len(self.own):
+            return self.own[index]
+        return f"{self.repeats[index - len(self.own)]} (repeats)"
+
+
+## Store with recurring tasks
+# Wraps a user's task store and rule book so the app sees one store: reads
+# merge the one-off tasks with the occurrences in the window asked for, and
+# changes to an occurrence become an override on its rule.
+class RecurringStore:
+    def __init__(self, store, rules):
+        self.store = store
+        self.rules = rules
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def __len__(self):
+        return len(self.store) + len(self.rules)
+
+    @property
+    def version(self):
+        # Both draw from data_versions, so the larger one moves on any change
+        return max(self.store.version, self.rules.version)
+
+    def is_stale(self):
+        return self.rules.changed() or self.store.is_stale()
+
+    def tasks_between(self, start, end):
+        own, repeats = self.store.tasks_between(start, end), self.rules.tasks_between(start, end)
+        if repeats.empty:
+            return own
+        return pd.concat([own, repeats]) if len(own) else repeats
+
+    def count_on(self, day):
+        return self.store.count_on(day) + len(self.rules.tasks_between(day, day))
+
+    def tasks_on(self, day, start=0, stop=None):
+        # The day's one-off tasks first, then its occurrences
+        own_count = self.store.count_on(day)
+        frames = []
+        if start < own_count:
+            frames.append(self.store.tasks_on(day, start, stop if stop is None else min(stop, own_count)))
+        if stop is None or stop > own_count:
+            repeats = self.rules.tasks_between(day, day)
+            frames.append(repeats.iloc[max(0, start - own_count):None if stop is None else stop - own_count])
+        frames = [frame for frame in frames if len(frame)]
+        return pd.concat(frames) if len(frames) > 1 else (frames[0] if frames else empty_tasks())
+
+    def search(self, query, limit=20):
+        # Rules match once each, dated by their first occurrence
+        return merge_hits(limit, self.store.search(query, limit), self.rules.search_index.search(query, limit))
+
+    def category_overview(self):
+        # The store's summaries are passed on as they are; a category with
+        # rules gets a view over both name lists instead of a merged copy
+        merged = {cat.name: cat for cat in self.store.category_overview()}
+        for cat in self.rules.rollup().overview():
+            own = merged.get(cat.name, CategorySummary(cat.name, 0, 0, []))
+            merged[cat.name] = CategorySummary(
+                cat.name, own.total + cat.total, own.open + cat.open, RepeatingNames(own.tasks, cat.tasks)
+            )
+        return [merged[name] for name in sorted(merged)]
+
+    def recurring_rules(self):
+        return list(self.rules.rules.values())
+
+    def workload_between(self, start, end):
+        # Occurrences are counted from the window's expansion
+        workload = self.store.workload_between(start, end)
+        repeats = self.rules.tasks_between(start, end)
+        return workload if repeats.empty else workload + WorkloadRollup(repeats).between(start, end)
+
+    def first_due_date(self):
+        starts = [pd.to_datetime(rule["Start"], format=DATE_FORMAT).date() for rule in self.rules.rules.values()]
+        return min(filter(None, [self.store.first_due_date(), *starts]), default=None)
+
+    ## Changes
+    def add_recurring(self, task, rrule):
+        return self.rules.add(task, rrule)
+
+    def remove_recurring(self, rule_id):
+        self.rules.remove(rule_id)
+
+    def set_completed(self, key, completed):
+        occurrence = split_occurrence_key(key, self.rules.rules)
+        if occurrence is None:
+            self.store.set_completed(key, completed)
+        else:
+            self.rules.override(*occurrence, Completed=bool(completed))
+
+    def delete(self, key):
+        occurrence = split_occurrence_key(key, self.rules.rules)
+        if occurrence is None:
+            self.store.delete(key)
+        else:
+            self.rules.override(*occurrence, deleted=True)
+
+    def delete_many(self, keys):
+        own = []
+        for key in keys:
+            occurrence = split_occurrence_key(key, self.rules.rules)
+            if occurrence is None:
+                own.append(key)
+            else:
+                self.rules.override(*occurrence, deleted=True)
+        if own:
+            self.store.delete_many(own)
+
+
+class RecurringStorage:
+    # Wraps a storage backend so open() returns RecurringStores; everything
+    # else goes to the backend
+    def __init__(self, backend, folder):
+        self.backend = backend
+        self.folder = Path(folder)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def rules_path(self, user_id):
+        return self.folder / f"recurring_{user_id}.json"
+
+    def open(self, user_id):
+        return RecurringStore(self.backend.open(user_id), RuleBook(self.rules_path(user_id)))
@@ -0,0 +1,141 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+## Full-text search
+# Inverted index from token to the tasks whose Task, Category or Description
+# contain it, kept up to date as tasks change. Queries look tokens up by
+# prefix in a sorted vocabulary, so "gro mil" finds "Groceries: milk", and
+# never scan the tasks. Every query word has to match; hits are ranked by
+# where they matched (name over category over description), exact over
+# prefix matches and how rare the word is.
+TOKEN = re.compile(r"\w+")
+FIELD_WEIGHTS = {"Task": 3.0, "Category": 2.0, "Description": 1.0}
+PREFIX_WEIGHT = 0.5
+# Shorter words only match whole tokens; "a" would otherwise match half the index
+MIN_PREFIX = 2
+
+SearchHit = namedtuple("SearchHit", ["id", "task", "category", "due", "completed", "score"])
+
+def merge_hits(limit, *hit_lists):
+    # The best hits of several searches, ranked as if they were one
+    return heapq.nsmallest(limit, [hit for hits in hit_lists for hit in hits], key=lambda hit: (-hit.score, hit.completed))
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    def __init__(self, tasks=None):
+        # tasks: frame with the task columns, including ID
+        self.lock = threading.RLock()
+        self.postings = {}  # token -> {task id: field weight}
+        self.vocabulary = []  # sorted tokens, for prefix lookups
+        self.docs = {}  # task id -> (tokens, name, category, due date, completed)
+        if tasks is None or tasks.empty:
+            return
+        columns = [tasks[col].tolist() for col in ("ID", "Task", "Category", "Description", "Due Date", "Completed")]
+        for task_id, name, category, description, due, completed in zip(*columns):
+            self._index(task_id, name, category, description, due, completed)
+        self.vocabulary = sorted(self.postings)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _index(self, task_id, name, category, description, due, completed):
+        weights = {}
+        for field, text in (("Task", name), ("Category", category), ("Description", description)):
+            for token in tokenize(text):
+                weights[token] = weights.get(token, 0) + FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            self.postings.setdefault(token, {})[task_id] = weight
+        self.docs[task_id] = (tuple(weights), name, category, None if pd.isna(due) else due, bool(completed))
+        return weights
+
+    ## Changes
+    def add(self, task):
+        with self.lock:
+            self.remove(task["ID"])
+            for token in self._index(
+                task["ID"], task.get("Task"), task.get("Category"), task.get("Description"),
+                pd.to_datetime(task.get("Due Date"), errors="coerce"), task.get("Completed"),
+            ):
+                if len(self.postings[token]) == 1:
+                    bisect.insort(self.vocabulary, token)
+
+    def add_many(self, tasks):
+        with self.lock:
+            for task in tasks.to_dict("records"):
+                self.add(task)
+
+    def remove(self, task_id):
+        with self.lock:
+            doc = self.docs.pop(task_id, None)
+            if doc is None:
+                return
+            for token in doc[0]:
+                postings = self.postings[token]
+                del postings[task_id]
+                if not postings:
+                    del self.postings[token]
+                    del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def set_completed(self, task_id, completed):
+        with self.lock:
+            if task_id in self.docs:
+                self.docs[task_id] = (*self.docs[task_id][:4], bool(completed))
+
+    ## Queries
+    def _boosts(self, word):
+        # {token: boost} for every token starting with word. Exact matches
+        # count double, and rarer words count for more.
+        if len(word) < MIN_PREFIX:
+            tokens = [word] if word in self.postings else []
+        else:
+            start = bisect.bisect_left(self.vocabulary, word)
+            end = bisect.bisect_left(self.vocabulary, word[:-1] + chr(ord(word[-1]) + 1), start)
+            tokens = self.vocabulary[start:end]
+        matching = sum(len(self.postings[token]) for token in tokens)
+        idf = math.log((len(self.docs) + 1) / (matching + 1) + 1)
+        return {token: idf * (1.0 if token == word else PREFIX_WEIGHT) for token in tokens}, matching
+
+    def search(self, query, limit=20):
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            # Postings are only walked for the rarest word; the others are
+            # checked against each candidate's own few tokens
+            boosts = sorted((self._boosts(word) for word in set(words)), key=lambda item: item[1])
+            scores = {}
+            for token, boost in boosts[0][0].items():
+                for task_id, weight in self.postings[token].items():
+                    if weight * boost > scores.get(task_id, 0):
+                        scores[task_id] = weight * boost
+            for word_boosts, _ in boosts[1:]:
+                narrowed = {}
+                for task_id, score in scores.items():
+                    best = max(
+                        (self.postings[token][task_id] * word_boosts[token]
+                         for token in self.docs[task_id][0] if token in word_boosts),
+                        default=0,
+                    )
+                    if best:
+                        narrowed[task_id] = score + best
+                scores = narrowed
+            if len(scores) > limit:
+                # Cut down to the best few before the full sort
+                task_ids = list(scores)
+                values = np.fromiter(scores.values(), dtype=float, count=len(scores))
+                scores = {task_ids[i]: values[i] for i in np.argpartition(-values, limit - 1)[:limit]}
+            # Best score first; open tasks before finished ones on a tie
+            ranked = sorted(scores.items(), key=lambda hit: (-hit[1], self.docs[hit[0]][4]))[:limit]
+            return [SearchHit(task_id, *self.docs[task_id][1:], round(float(score), 3)) for task_id, score in ranked]
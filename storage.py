@@ -0,0 +1,1228 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analytics import WorkloadRollup
+from search import SearchIndex
+from task_store import CategoryRollup, TaskStore, apply_ops, data_versions, ensure_ids, new_task_id
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks below only cover threads of this process
+    fcntl = None
+
+TASK_COLUMNS = ["Task", "Category", "Due Date", "Priority", "Completed", "Description", "ID"]
+DATE_FORMAT = "%m-%d-%Y"
+
+logger = logging.getLogger("to_do.storage")
+
+def empty_tasks():
+    return pd.DataFrame(columns=TASK_COLUMNS)
+
+## File locks
+# Advisory lock on <file>.lock around every write to a user's file, shared by
+# threads and by other processes (app replicas) using the same folder. Only
+# the file being written is locked, and only while it is written.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = threading.local()
+
+@contextmanager
+def file_lock(path):
+    key = str(path)
+    held = _held.__dict__.setdefault("paths", set())
+    if key in held:
+        yield
+        return
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(key, threading.Lock())
+    with thread_lock, open(f"{key}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_stamp(path):
+    # Changes whenever the file is rewritten or appended to
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+## Plain CSV: one file per user, rewritten in full on every change
+# Writers use optimistic versioning: we remember the file's stamp from our
+# last read or write, and if it differs at commit time someone else saved in
+# between. Our changes are then replayed by task ID onto their version
+# instead of overwriting it, and the user is flagged as changed so the
+# session store gets reloaded. Until it is, that store's table is behind
+# the file, so its later commits are merged the same way.
+class CsvStorage:
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.folder.mkdir(exist_ok=True)
+        self._seen = {}
+        self._stale = set()
+
+    def path(self, user_id):
+        return self.folder / f"tasks_{user_id}.csv"
+
+    def data_path(self, user_id):
+        # The file whose stamp tells whether a user's tasks changed
+        return self.path(user_id)
+
+    def read(self, user_id):
+        data_file = self.path(user_id)
+        if data_file.exists():
+            return pd.read_csv(data_file)
+        return empty_tasks()
+
+    def write(self, user_id, df):
+        to_app_format(df).to_csv(self.path(user_id), index=False)
+
+    def _stamp(self, user_id):
+        return file_stamp(self.data_path(user_id))
+
+    def mark_seen(self, user_id):
+        self._seen[user_id] = self._stamp(user_id)
+        self._stale.discard(user_id)
+
+    def changed(self, user_id):
+        return user_id in self._stale or self._stamp(user_id) != self._seen.get(user_id)
+
+    def load(self, user_id):
+        with file_lock(self.data_path(user_id)):
+            df = self.read(user_id)
+            self.mark_seen(user_id)
+        return ensure_ids(df)
+
+    def save(self, user_id, df):
+        with file_lock(self.data_path(user_id)):
+            self.write(user_id, df)
+            self.mark_seen(user_id)
+
+    def commit(self, user_id, df, ops):
+        # df is our table after ops; ops are the change records behind it
+        with file_lock(self.data_path(user_id)):
+            conflict = user_id in self._stale or self._stamp(user_id) != self._seen.get(user_id)
+            if conflict:
+                df = apply_ops(self.read(user_id), ops)
+            self.write(user_id, df)
+            self.mark_seen(user_id)
+            if conflict:
+                self._stale.add(user_id)
+
+    def open(self, user_id):
+        # Session-side store, queried in memory and written back through us
+        return TaskStore(self.load(user_id), self, user_id)
+
+    def flush(self, key=None, timeout=None):
+        # Writes are synchronous here; BackgroundWriter overrides this
+        return True
+
+    # Change hooks get the table as it is *after* the change. A CSV file has
+    # nothing cheaper than a full rewrite, other backends can do better.
+    def add(self, user_id, df, task):
+        self.commit(user_id, df, [("add", task)])
+
+    def add_many(self, user_id, df, tasks):
+        self.commit(user_id, df, [("add_many", to_app_format(tasks))])
+
+    def set_completed(self, user_id, df, task_id, completed):
+        self.commit(user_id, df, [("set_completed", task_id, completed)])
+
+    def delete(self, user_id, df, task_id):
+        self.commit(user_id, df, [("delete", task_id)])
+
+    def delete_many(self, user_id, df, task_ids):
+        self.commit(user_id, df, [("delete_many", list(task_ids))])
+
+
+## Journal: append-only operation log with periodic compaction
+# tasks_<user_id>.journal holds one JSON record per line. The first record is a
+# snapshot of the whole table, every later one is a single add/complete/delete
+# naming its task by ID, so appends from several processes interleave safely.
+# Once enough operations pile up, a background thread replays the file into
+# a fresh snapshot, writes it to a temp file and swaps it in with os.replace,
+# so a crash at any point leaves either the old or the new journal on disk.
+# A torn last line from a crash mid-append is cut off on load, and appends
+# start on a fresh line in case one was left since; any other unreadable
+# line is skipped rather than ending the replay.
+class JournalStorage(CsvStorage):
+    def __init__(self, folder, compact_after=200):
+        super().__init__(folder)
+        self.compact_after = compact_after
+        self._op_counts = {}
+        self._compacting = set()
+
+    def journal_path(self, user_id):
+        return self.folder / f"tasks_{user_id}.journal"
+
+    def data_path(self, user_id):
+        return self.journal_path(user_id)
+
+    def load(self, user_id):
+        with file_lock(self.journal_path(user_id)):
+            if not self.journal_path(user_id).exists():
+                # First use of the journal: start from the existing CSV, if any
+                self.write(user_id, ensure_ids(super().read(user_id)))
+            else:
+                _cut_torn_line(self.journal_path(user_id))
+            return super().load(user_id)
+
+    def read(self, user_id):
+        rows, ops, legacy_ids = {}, 0, 0
+        with open(self.journal_path(user_id), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                op = record["op"]
+                if op == "snapshot":
+                    rows, ops = {}, 0
+                    for task in record["tasks"]:
+                        if not task.get("ID"):
+                            # Snapshots from before task IDs
+                            task["ID"], legacy_ids = f"row{legacy_ids}", legacy_ids + 1
+                        rows[task["ID"]] = task
+                    continue
+                task_id = record.get("id")
+                if task_id is None and op != "add":
+                    # Records from before task IDs name rows by position
+                    task_id = list(rows)[record["row"]]
+                if op == "add":
+                    task = record["task"]
+                    if not task.get("ID"):
+                        task["ID"], legacy_ids = f"row{legacy_ids}", legacy_ids + 1
+                    rows[task["ID"]] = task
+                elif op == "complete" and task_id in rows:
+                    rows[task_id]["Completed"] = record["value"]
+                elif op == "delete":
+                    rows.pop(task_id, None)
+                ops += 1
+        self._op_counts[user_id] = ops
+        if not rows:
+            return empty_tasks()
+        return pd.DataFrame(list(rows.values()), columns=TASK_COLUMNS)
+
+    def _snapshot_line(self, df):
+        return '{"op": "snapshot", "tasks": ' + to_app_format(df).to_json(orient="records") + "}\n"
+
+    def write(self, user_id, df):
+        journal = self.journal_path(user_id)
+        tmp = journal.with_suffix(".journal.tmp")
+        _write_durably(tmp, self._snapshot_line(df))
+        os.replace(tmp, journal)
+        self._op_counts[user_id] = 0
+
+    def commit(self, user_id, df, ops):
+        lines = []
+        for op, *args in ops:
+            if op == "add":
+                task = {k: (bool(v) if k == "Completed" else v) for k, v in args[0].items()}
+                lines.append(json.dumps({"op": "add", "task": task}))
+            elif op == "add_many":
+                tasks = args[0].reindex(columns=TASK_COLUMNS).to_json(orient="records", lines=True)
+                lines.extend('{"op": "add", "task": ' + task + "}" for task in tasks.splitlines())
+            elif op == "set_completed":
+                lines.append(json.dumps({"op": "complete", "id": args[0], "value": bool(args[1])}))
+            elif op == "delete":
+                lines.append(json.dumps({"op": "delete", "id": args[0]}))
+            elif op == "delete_many":
+                lines.extend(json.dumps({"op": "delete", "id": task_id}) for task_id in args[0])
+
+        text = "".join(line + "\n" for line in lines)
+        with file_lock(self.journal_path(user_id)):
+            # Someone else's records stay where they are; we just reload
+            conflict = self._stamp(user_id) != self._seen.get(user_id)
+            with open(self.journal_path(user_id), "ab+") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # Don't glue our records onto a torn one
+                        text = "\n" + text
+                f.write(text.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            self.mark_seen(user_id)
+            if conflict:
+                self._stale.add(user_id)
+            ops = self._op_counts.get(user_id, 0) + len(lines)
+            self._op_counts[user_id] = ops
+            if ops < self.compact_after or user_id in self._compacting:
+                return
+            self._compacting.add(user_id)
+        threading.Thread(target=self._compact, args=(user_id,), daemon=True).start()
+
+    def _compact(self, user_id):
+        try:
+            with file_lock(self.journal_path(user_id)):
+                conflict = self._stamp(user_id) != self._seen.get(user_id)
+                self.write(user_id, self.read(user_id))
+                self.mark_seen(user_id)
+                if conflict:
+                    self._stale.add(user_id)
+        finally:
+            self._compacting.discard(user_id)
+
+
+## Arrow: typed columnar files
+# tasks_<user_id>.arrow is an uncompressed Arrow IPC file with native dates and
+# booleans and dictionary-encoded Category/Priority, so loading is a straight
+# conversion to pandas columns with no text to parse. The file is read through
+# a memory map, but the conversion copies the columns into the store's own
+# buffers. An existing CSV is converted the first time a user is loaded.
+ARROW_DICTIONARY_COLUMNS = {"Category", "Priority"}
+
+class ArrowStorage(CsvStorage):
+    def arrow_path(self, user_id):
+        return self.folder / f"tasks_{user_id}.arrow"
+
+    def data_path(self, user_id):
+        return self.arrow_path(user_id)
+
+    def load(self, user_id):
+        with file_lock(self.arrow_path(user_id)):
+            if not self.arrow_path(user_id).exists():
+                self.write(user_id, ensure_ids(super().read(user_id)))
+            return super().load(user_id)
+
+    def read(self, user_id):
+        import pyarrow as pa
+
+        table = pa.ipc.open_file(pa.memory_map(str(self.arrow_path(user_id)))).read_all()
+        return table.to_pandas(date_as_object=False)
+
+    def write(self, user_id, df):
+        import pyarrow as pa
+
+        df = df.reindex(columns=TASK_COLUMNS)
+        arrays = {}
+        for col in TASK_COLUMNS:
+            values = df[col]
+            if col == "Due Date":
+                due = pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[D]")
+                arrays[col] = pa.array(due, type=pa.date32(), from_pandas=True)
+            elif col == "Completed":
+                arrays[col] = pa.array(values.fillna(False).astype(bool).to_numpy())
+            else:
+                array = pa.array(values.astype(object).to_numpy(), type=pa.string(), from_pandas=True)
+                arrays[col] = array.dictionary_encode() if col in ARROW_DICTIONARY_COLUMNS else array
+        table = pa.table(arrays)
+
+        arrow_file = self.arrow_path(user_id)
+        tmp = arrow_file.with_suffix(".arrow.tmp")
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, arrow_file)
+
+
+## Partitioned: one file per due month
+# user_tasks/<user_id>/<YYYY-MM>.csv holds the tasks due that month (tasks
+# without a due date go to "undated"), next to a <YYYY-MM>.summary.json with
+# that month's row count, category rollup and per-day workload. A session only parses the
+# months it shows; the sidebar is built from the small summaries, and a
+# change rewrites just its own month. A user's old single CSV is split up
+# the first time they are opened.
+UNDATED = "undated"
+
+class _PartitionFiles(CsvStorage):
+    # Lets a plain TaskStore own one partition: its "user id" is "<user_id>/<month>"
+    def path(self, key):
+        user_id, partition = key.rsplit("/", 1)
+        return self.folder / user_id / f"{partition}.csv"
+
+    def summary_path(self, key):
+        return self.path(key).with_suffix(".summary.json")
+
+    def write(self, key, df):
+        super().write(key, df)
+        completed = int(df["Completed"].fillna(False).astype(bool).sum())
+        summary = {
+            "count": len(df), "completed": completed, "days": WorkloadRollup(df).state(), **CategoryRollup(df).state()
+        }
+        tmp = self.summary_path(key).with_suffix(".tmp")
+        _write_durably(tmp, json.dumps(summary))
+        os.replace(tmp, self.summary_path(key))
+
+
+def partition_of(due):
+    due = pd.to_datetime(due, errors="coerce")
+    return UNDATED if pd.isna(due) else f"{due.year:04d}-{due.month:02d}"
+
+def _months(start, end):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class PartitionedStorage(CsvStorage):
+    def __init__(self, folder, max_open_partitions=24):
+        super().__init__(folder)
+        self.files = _PartitionFiles(folder)
+        self.max_open_partitions = max_open_partitions
+
+    def user_folder(self, user_id):
+        return self.folder / user_id
+
+    def partitions(self, user_id):
+        return sorted(p.stem for p in self.user_folder(user_id).glob("*.csv"))
+
+    def _split_legacy(self, user_id):
+        # First open: split tasks_<user_id>.csv (if any) into month files. The
+        # months are written to a temp folder that is renamed into place.
+        user_folder = self.user_folder(user_id)
+        tmp = user_folder.with_name(user_folder.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        df = super().load(user_id)
+        if not df.empty:
+            parts = format_dates(pd.to_datetime(df["Due Date"], errors="coerce"), "%Y-%m").fillna(UNDATED)
+            for partition, part in df.groupby(parts, sort=False):
+                self.files.save(f"{user_id}.tmp/{partition}", part.reset_index(drop=True))
+        self.files.flush()
+        os.replace(tmp, user_folder)
+
+    def load(self, user_id):
+        if not self.user_folder(user_id).exists():
+            self._split_legacy(user_id)
+        frames = [self.files.load(f"{user_id}/{p}") for p in self.partitions(user_id)]
+        return pd.concat(frames, ignore_index=True) if frames else empty_tasks()
+
+    def save(self, user_id, df):
+        df = ensure_ids(df)
+        user_folder = self.user_folder(user_id)
+        shutil.rmtree(user_folder, ignore_errors=True)
+        user_folder.mkdir()
+        parts = format_dates(pd.to_datetime(df["Due Date"], errors="coerce"), "%Y-%m").fillna(UNDATED)
+        for partition, part in df.groupby(parts, sort=False):
+            self.files.save(f"{user_id}/{partition}", part.reset_index(drop=True))
+        self.files.flush()
+
+    def open(self, user_id):
+        if not self.user_folder(user_id).exists():
+            self._split_legacy(user_id)
+        return PartitionedTaskStore(self, user_id)
+
+
+# Session-side view over a user's month files. Months are loaded into their
+# own TaskStore on first use and kept in a small LRU. Rows are keyed
+# "<month>/<task id>".
+class PartitionedTaskStore:
+    def __init__(self, storage, user_id):
+        self.storage = storage
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self.version = next(data_versions)
+        self._open = OrderedDict()
+        self._counts = {}
+        # Completed tasks per month, from the summaries; dropped once a month is loaded
+        self._completed = {}
+        self._stale = False
+        self._search = None
+        self.categories = CategoryRollup()
+        # Per-day workload of the months not open, from the summaries (or
+        # as they were when closed); open months keep their own
+        self._workloads = {}
+        for partition in storage.partitions(user_id):
+            summary_file = storage.files.summary_path(self._key(partition))
+            if summary_file.exists():
+                summary = json.loads(summary_file.read_text(encoding="utf-8"))
+            else:
+                part = self._partition(partition)
+                summary = {"count": len(part), **part.categories.state()}
+            self._counts[partition] = summary["count"]
+            self._completed[partition] = summary.get("completed")
+            if "days" in summary:
+                self._workloads[partition] = WorkloadRollup()
+                self._workloads[partition].merge(summary["days"])
+            self.categories.merge(summary)
+            storage.files.mark_seen(self._key(partition))
+
+    def _key(self, partition):
+        return f"{self.user_id}/{partition}"
+
+    def _partition(self, partition):
+        part = self._open.get(partition)
+        if part is None:
+            files = self.storage.files
+            # A month changed since we opened no longer matches our counts
+            self._stale = self._stale or files.changed(self._key(partition))
+            tasks = files.load(self._key(partition)) if files.path(self._key(partition)).exists() else empty_tasks()
+            part = TaskStore(tasks, files, self._key(partition))
+            self._open[partition] = part
+            self._completed.pop(partition, None)
+            while len(self._open) > self.storage.max_open_partitions:
+                closed, closed_part = self._open.popitem(last=False)
+                self._workloads[closed] = closed_part.workload
+        self._open.move_to_end(partition)
+        return part
+
+    def _rekey(self, partition, df):
+        return df.set_axis([f"{partition}/{task_id}" for task_id in df.index])
+
+    def __len__(self):
+        return sum(self._counts.values())
+
+    @property
+    def tasks(self):
+        # Every month at once; for exports, not for reruns
+        with self.lock:
+            frames = [self._partition(p).tasks for p in sorted(self._counts)]
+        return pd.concat(frames, ignore_index=True) if frames else empty_tasks()
+
+    def tasks_on(self, day, start=0, stop=None):
+        partition = partition_of(day)
+        with self.lock:
+            if partition not in self._counts:
+                return empty_tasks()
+            return self._rekey(partition, self._partition(partition).tasks_on(day, start, stop))
+
+    def count_on(self, day):
+        partition = partition_of(day)
+        with self.lock:
+            return self._partition(partition).count_on(day) if partition in self._counts else 0
+
+    def tasks_between(self, start, end):
+        with self.lock:
+            frames = [
+                self._rekey(p, self._partition(p).tasks_between(start, end))
+                for p in _months(start, end) if p in self._counts
+            ]
+        return pd.concat(frames) if frames else empty_tasks()
+
+    def completed_between(self, start, end):
+        # Months whose summary shows no completed tasks aren't loaded
+        with self.lock:
+            frames = [
+                self._rekey(p, self._partition(p).completed_between(start, end))
+                for p in _months(start, end) if p in self._counts and self._completed.get(p) != 0
+            ]
+        return pd.concat(frames) if frames else empty_tasks()
+
+    def category_overview(self):
+        with self.lock:
+            return self.categories.overview()
+
+    def workload_between(self, start, end):
+        # Months written before summaries had workloads are loaded once
+        with self.lock:
+            merged = WorkloadRollup()
+            for p in _months(start, end):
+                if p in self._open or (p in self._counts and p not in self._workloads):
+                    merged.merge(self._partition(p).workload.state())
+                elif p in self._workloads:
+                    merged.merge(self._workloads[p].state())
+            return merged.between(start, end)
+
+    def first_due_date(self):
+        # The first of the earliest month with tasks, from the counts alone
+        with self.lock:
+            months = [p for p, count in self._counts.items() if count and p != UNDATED]
+        return pd.Timestamp(min(months)).date() if months else None
+
+    def search(self, query, limit=20):
+        # Indexed by row key, as IDs from before task IDs repeat across months
+        with self.lock:
+            if self._search is None:
+                self._search = SearchIndex(pd.concat(
+                    [self._keyed(p, self._partition(p).tasks) for p in sorted(self._counts)] or [empty_tasks()]
+                ))
+            return self._search.search(query, limit)
+
+    def _keyed(self, partition, tasks):
+        return tasks.assign(ID=partition + "/" + tasks["ID"].astype(str))
+
+    def is_stale(self):
+        files = self.storage.files
+        partitions = self.storage.partitions(self.user_id)
+        return self._stale or set(partitions) != set(self._counts) or any(files.changed(self._key(p)) for p in partitions)
+
+    ## Changes
+    def add(self, task):
+        partition = partition_of(task.get("Due Date"))
+        with self.lock:
+            task = {**task, "ID": task.get("ID") or new_task_id()}
+            self._partition(partition).add(task)
+            self._counts[partition] = self._counts.get(partition, 0) + 1
+            if self._search is not None:
+                self._search.add({**task, "ID": f"{partition}/{task['ID']}"})
+            self.categories.add(task.get("Category"), task.get("Task"), bool(task.get("Completed")))
+            self.version = next(data_versions)
+
+    def add_many(self, tasks):
+        parts = format_dates(pd.to_datetime(tasks["Due Date"], errors="coerce"), "%Y-%m").fillna(UNDATED)
+        added = []
+        with self.lock:
+            for partition, part_tasks in tasks.groupby(parts, sort=False):
+                part_added = self._partition(partition).add_many(part_tasks)
+                self._counts[partition] = self._counts.get(partition, 0) + len(part_added)
+                self.categories.merge(CategoryRollup(part_added).state())
+                if self._search is not None:
+                    self._search.add_many(self._keyed(partition, part_added))
+                added.append(part_added)
+            self.version = next(data_versions)
+        return pd.concat(added, ignore_index=True) if added else empty_tasks()
+
+    def set_completed(self, key, completed):
+        partition, task_id = key.split("/", 1)
+        with self.lock:
+            part = self._partition(partition)
+            summary = part.row_summary(task_id)
+            if summary is None:
+                return
+            category, _, was_completed = summary
+            part.set_completed(task_id, completed)
+            self.categories.set_completed(category, was_completed, completed)
+            if self._search is not None:
+                self._search.set_completed(key, completed)
+            self.version = next(data_versions)
+
+    def delete(self, key):
+        partition, task_id = key.split("/", 1)
+        with self.lock:
+            part = self._partition(partition)
+            summary = part.row_summary(task_id)
+            if summary is None:
+                return
+            self.categories.remove(*summary)
+            part.delete(task_id)
+            self._counts[partition] -= 1
+            if self._search is not None:
+                self._search.remove(key)
+            self.version = next(data_versions)
+
+    def delete_many(self, keys):
+        by_partition = {}
+        for key in keys:
+            partition, task_id = key.split("/", 1)
+            by_partition.setdefault(partition, []).append(task_id)
+        with self.lock:
+            for partition, task_ids in by_partition.items():
+                if partition not in self._counts:
+                    continue
+                part = self._partition(partition)
+                for summary in filter(None, map(part.row_summary, task_ids)):
+                    self.categories.remove(*summary)
+                part.delete_many(task_ids)
+                self._counts[partition] = len(part)
+                if self._search is not None:
+                    for task_id in task_ids:
+                        self._search.remove(f"{partition}/{task_id}")
+            self.version = next(data_versions)
+
+
+## SQLite: every user's tasks in one WAL-mode database
+# Due dates are stored as ISO text so the (user_id, due_date) index serves
+# range queries. Each thread gets its own connection. user_versions counts
+# each user's changes, so a store can tell when another process wrote.
+# SQLite numbers the rows itself; a task's ID from a file it came in with
+# is kept in ext_id, unique per user, so the same file isn't imported twice.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    category TEXT,
+    due_date TEXT,
+    priority TEXT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    description TEXT,
+    ext_id TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_user_due ON tasks (user_id, due_date);
+CREATE INDEX IF NOT EXISTS tasks_user_category ON tasks (user_id, category);
+CREATE INDEX IF NOT EXISTS tasks_user_completed ON tasks (user_id, completed);
+CREATE TABLE IF NOT EXISTS csv_imports (user_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS user_versions (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL);
+"""
+
+SQLITE_SELECT = """
+SELECT id, task AS "Task", category AS "Category", due_date AS "Due Date",
+       priority AS "Priority", completed AS "Completed", description AS "Description",
+       CAST(id AS TEXT) AS "ID"
+FROM tasks
+"""
+
+SQLITE_INSERT = (
+    "INSERT INTO tasks (user_id, task, category, due_date, priority, completed, description, ext_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+class SqliteStorage(CsvStorage):
+    def __init__(self, folder, db_name="tasks.db"):
+        super().__init__(folder)
+        self.db_path = self.folder / db_name
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+            if "ext_id" not in {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}:
+                # Databases from before ext_id
+                conn.execute("ALTER TABLE tasks ADD COLUMN ext_id TEXT")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tasks_user_ext ON tasks (user_id, ext_id)")
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def query(self, where, params, order="id", start=0, stop=None):
+        sql = f"{SQLITE_SELECT} WHERE {where} ORDER BY {order}"
+        if start or stop is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params = (*params, -1 if stop is None else stop - start, start)
+        df = pd.read_sql_query(sql, self.connect(), params=params, index_col="id")
+        df["Due Date"] = pd.to_datetime(df["Due Date"], format="%Y-%m-%d", errors="coerce")
+        df["Completed"] = df["Completed"].astype(bool)
+        return df
+
+    def load(self, user_id):
+        self.import_csv(user_id)
+        return self.query("user_id = ?", (user_id,)).reset_index(drop=True)
+
+    def save(self, user_id, df):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
+            conn.executemany(SQLITE_INSERT, _sqlite_rows(user_id, df))
+            self.bump_version(conn, user_id)
+
+    def open(self, user_id):
+        self.import_csv(user_id)
+        return SqliteTaskStore(self, user_id)
+
+    def import_csv(self, user_id):
+        # One-shot import of a user's tasks_<user_id>.csv, if there is one
+        conn = self.connect()
+        if conn.execute("SELECT 1 FROM csv_imports WHERE user_id = ?", (user_id,)).fetchone():
+            return False
+        data_file = self.path(user_id)
+        with conn:
+            if data_file.exists():
+                conn.executemany(SQLITE_INSERT, _sqlite_rows(user_id, pd.read_csv(data_file)))
+            conn.execute("INSERT INTO csv_imports (user_id) VALUES (?)", (user_id,))
+            self.bump_version(conn, user_id)
+        return True
+
+    def bump_version(self, conn, user_id):
+        # Call inside the change's transaction; returns the new version
+        conn.execute(
+            "INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+            "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+            (user_id,),
+        )
+        return self.data_version(user_id, conn)
+
+    def data_version(self, user_id, conn=None):
+        conn = conn or self.connect()
+        row = conn.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def migrate_csv_files(self):
+        imported = []
+        for data_file in sorted(self.folder.glob("tasks_*.csv")):
+            user_id = data_file.stem[len("tasks_"):]
+            if self.import_csv(user_id):
+                imported.append(user_id)
+        return imported
+
+
+# Session-side view of one user's tasks in SQLite. Rows are keyed by task id
+# and every read is a single query against one of the per-user indexes.
+class SqliteTaskStore:
+    def __init__(self, storage, user_id):
+        self.storage = storage
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self.version = next(data_versions)
+        self._db_version = storage.data_version(user_id)
+        self._search = None
+        self.categories = CategoryRollup(
+            storage.query("user_id = ? AND category IS NOT NULL", (user_id,), order="category, id")
+        )
+        self.workload = self._count_workload()
+
+    def _count_workload(self):
+        # Counted by the database, one row per (day, priority, completed)
+        groups = pd.read_sql_query(
+            'SELECT due_date AS "Due Date", priority AS "Priority", completed AS "Completed", COUNT(*) AS "Count" '
+            "FROM tasks WHERE user_id = ? AND due_date IS NOT NULL GROUP BY due_date, priority, completed",
+            self.storage.connect(), params=(self.user_id,),
+        )
+        groups["Due Date"] = pd.to_datetime(groups["Due Date"], format="%Y-%m-%d", errors="coerce")
+        return WorkloadRollup(groups)
+
+    def __len__(self):
+        conn = self.storage.connect()
+        return conn.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+
+    @property
+    def tasks(self):
+        return self.storage.query("user_id = ?", (self.user_id,)).reset_index(drop=True)
+
+    def tasks_on(self, day, start=0, stop=None):
+        return self.storage.query(
+            "user_id = ? AND due_date = ?", (self.user_id, day.isoformat()), start=start, stop=stop
+        )
+
+    def count_on(self, day):
+        conn = self.storage.connect()
+        return conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE user_id = ? AND due_date = ?", (self.user_id, day.isoformat())
+        ).fetchone()[0]
+
+    def tasks_between(self, start, end):
+        return self.storage.query(
+            "user_id = ? AND due_date BETWEEN ? AND ?",
+            (self.user_id, start.isoformat(), end.isoformat()),
+            order="due_date, id",
+        )
+
+    def completed_between(self, start, end):
+        return self.storage.query(
+            "user_id = ? AND completed = 1 AND due_date BETWEEN ? AND ?",
+            (self.user_id, start.isoformat(), end.isoformat()),
+            order="due_date, id",
+        )
+
+    def category_overview(self):
+        with self.lock:
+            return self.categories.overview()
+
+    def workload_between(self, start, end):
+        with self.lock:
+            return self.workload.between(start, end)
+
+    def first_due_date(self):
+        with self.lock:
+            return self.workload.first_day()
+
+    def is_stale(self):
+        return self.storage.data_version(self.user_id) != self._db_version
+
+    def search(self, query, limit=20):
+        with self.lock:
+            if self._search is None:
+                self._search = SearchIndex(self.tasks)
+            return self._search.search(query, limit)
+
+    def row_summary(self, key):
+        conn = self.storage.connect()
+        return conn.execute(
+            "SELECT category, task, completed FROM tasks WHERE id = ? AND user_id = ?",
+            (int(key), self.user_id),
+        ).fetchone()
+
+    def _row_workload(self, key):
+        conn = self.storage.connect()
+        return conn.execute(
+            "SELECT due_date, priority, completed FROM tasks WHERE id = ? AND user_id = ?",
+            (int(key), self.user_id),
+        ).fetchone()
+
+    def _committed(self, conn):
+        # Our version is one ahead of the last one we saw, unless another
+        # process wrote in between; then the rollup is off and we're stale
+        seen = self.storage.bump_version(conn, self.user_id)
+        self._db_version = seen if seen == self._db_version + 1 else -1
+        self.version = next(data_versions)
+
+    ## Changes
+    def add(self, task):
+        with self.lock:
+            self.categories.add(task.get("Category"), task.get("Task"), bool(task.get("Completed")))
+            self.workload.add(task.get("Due Date"), task.get("Priority"), task.get("Completed"))
+            with self.storage.connect() as conn:
+                row = conn.execute(SQLITE_INSERT, next(_sqlite_rows(self.user_id, pd.DataFrame([task]))))
+                self._committed(conn)
+            if self._search is not None:
+                self._search.add({**task, "ID": str(row.lastrowid)})
+
+    def add_many(self, tasks):
+        # Tasks whose ID is one of our row ids (our own export) or an ID
+        # imported before are skipped
+        with self.lock:
+            conn = self.storage.connect()
+            if "ID" in tasks:
+                known = {row[0] for row in conn.execute(
+                    "SELECT CAST(id AS TEXT) FROM tasks WHERE user_id = ? "
+                    "UNION ALL SELECT ext_id FROM tasks WHERE user_id = ? AND ext_id IS NOT NULL",
+                    (self.user_id, self.user_id),
+                )}
+                tasks = tasks[~tasks["ID"].isin(known)]
+                tasks = tasks[tasks["ID"].isna() | ~tasks["ID"].duplicated()]
+            with conn:
+                conn.executemany(SQLITE_INSERT, _sqlite_rows(self.user_id, tasks))
+                self._committed(conn)
+            self.categories.merge(CategoryRollup(tasks).state())
+            self.workload.merge(WorkloadRollup(tasks).state())
+            # The new rows' ids aren't known here; index them on the next search
+            self._search = None
+        return tasks
+
+    def set_completed(self, key, completed):
+        with self.lock:
+            summary = self.row_summary(key)
+            if summary is None:
+                return
+            category, _, was_completed = summary
+            self.categories.set_completed(category, was_completed, completed)
+            self.workload.set_completed(*self._row_workload(key)[:2], was_completed, completed)
+            with self.storage.connect() as conn:
+                conn.execute(
+                    "UPDATE tasks SET completed = ? WHERE id = ? AND user_id = ?",
+                    (int(completed), int(key), self.user_id),
+                )
+                self._committed(conn)
+            if self._search is not None:
+                self._search.set_completed(str(key), completed)
+
+    def delete(self, key):
+        with self.lock:
+            summary = self.row_summary(key)
+            if summary is None:
+                return
+            self.categories.remove(*summary)
+            self.workload.remove(*self._row_workload(key))
+            with self.storage.connect() as conn:
+                conn.execute("DELETE FROM tasks WHERE id = ? AND user_id = ?", (int(key), self.user_id))
+                self._committed(conn)
+            if self._search is not None:
+                self._search.remove(str(key))
+
+    def delete_many(self, keys):
+        with self.lock:
+            with self.storage.connect() as conn:
+                conn.executemany(
+                    "DELETE FROM tasks WHERE id = ? AND user_id = ?", [(int(key), self.user_id) for key in keys]
+                )
+                self._committed(conn)
+            self.categories = CategoryRollup(
+                self.storage.query("user_id = ? AND category IS NOT NULL", (self.user_id,), order="category, id")
+            )
+            self.workload = self._count_workload()
+            if self._search is not None:
+                for key in keys:
+                    self._search.remove(str(key))
+
+
+def format_dates(dates, fmt):
+    # Formats each distinct date once; a task table has far fewer distinct
+    # due dates than rows. NaT becomes None.
+    codes, uniques = pd.factorize(dates)
+    formatted = np.append(uniques.strftime(fmt).to_numpy(dtype=object), None)
+    return pd.Series(formatted[codes], index=dates.index, dtype=object)
+
+def _to_iso(dates):
+    return format_dates(pd.to_datetime(dates, errors="coerce"), "%Y-%m-%d")
+
+def to_app_format(df):
+    # Stores hand out parsed due dates; files keep the app's "%m-%d-%Y" text
+    if not pd.api.types.is_datetime64_any_dtype(df["Due Date"]):
+        return df
+    return df.assign(**{"Due Date": format_dates(df["Due Date"], DATE_FORMAT)})
+
+def _sqlite_rows(user_id, df):
+    # The ID column goes to ext_id
+    df = df.reindex(columns=TASK_COLUMNS)
+    df = df.assign(**{"Due Date": _to_iso(df["Due Date"]), "Completed": df["Completed"].fillna(False).astype(bool).astype(int)})
+    df = df.astype(object).where(df.notna(), None)
+    for row in df.itertuples(index=False):
+        yield (user_id, *row)
+
+
+## Background writes
+# Wraps a backend so the change hooks return at once: each change record is
+# queued with a copy of the table (taken under the store's lock, so it is
+# consistent), which replaces the copy queued before it, and one writer
+# thread persists them. Everything queued for a user goes out as a single
+# commit of the latest table and the change records behind it, so
+# whole-file backends write once and the journal appends all the records
+# with one fsync. flush() blocks until queued writes are on disk and is the
+# acknowledgement; close() drains the queue and is registered to run at
+# exit. Loads flush the user's own writes first, so nothing is read back
+# from disk before its pending writes land. The SQLite store writes
+# straight to the database and is not affected.
+class BackgroundWriter:
+    def __init__(self, backend, delay=0.5):
+        self.backend = backend
+        self.delay = delay
+        self._pending = OrderedDict()
+        self._writing = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="task-writer", daemon=True)
+        self._thread.start()
+        # Partitioned storage writes through a per-month file store of its own
+        self._inner = None
+        if isinstance(getattr(backend, "files", None), CsvStorage):
+            self._inner = backend.files = BackgroundWriter(backend.files, delay)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    ## Change hooks
+    def _enqueue(self, key, df, op):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BackgroundWriter is closed")
+            _, ops = self._pending.get(key, (None, []))
+            self._pending[key] = (df.copy(), ops + [op])
+            self._cond.notify_all()
+
+    def save(self, key, df):
+        # Whole-table saves are not change records; write them right away
+        self.flush(key)
+        self.backend.save(key, df)
+
+    def add(self, key, df, task):
+        self._enqueue(key, df, ("add", dict(task)))
+
+    def add_many(self, key, df, tasks):
+        self._enqueue(key, df, ("add_many", to_app_format(tasks)))
+
+    def set_completed(self, key, df, task_id, completed):
+        self._enqueue(key, df, ("set_completed", task_id, completed))
+
+    def delete(self, key, df, task_id):
+        self._enqueue(key, df, ("delete", task_id))
+
+    def delete_many(self, key, df, task_ids):
+        self._enqueue(key, df, ("delete_many", list(task_ids)))
+
+    ## Reads
+    def load(self, key, *args, **kwargs):
+        self.flush(key)
+        return self.backend.load(key, *args, **kwargs)
+
+    def open(self, user_id):
+        self.flush(user_id)
+        store = self.backend.open(user_id)
+        if getattr(store, "storage", None) is self.backend:
+            store.storage = self
+        return store
+
+    ## Acknowledgement and shutdown
+    def _pending_here(self, key):
+        # key None means everyone; a user's key also covers their month
+        # files ("<user_id>/<month>") in the partition writer
+        keys = [*self._pending, self._writing] if self._writing is not None else list(self._pending)
+        return any(key is None or k == key or k.startswith(f"{key}/") for k in keys)
+
+    def pending(self, key=None):
+        with self._cond:
+            if self._pending_here(key):
+                return True
+        return self._inner is not None and self._inner.pending(key)
+
+    def flush(self, key=None, timeout=None):
+        with self._cond:
+            done = self._cond.wait_for(lambda: not self._pending_here(key), timeout)
+        if self._inner is not None:
+            done = self._inner.flush(key, timeout) and done
+        return done
+
+    def close(self, timeout=30):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._inner is not None:
+            self._inner.close(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait_for(lambda: self._pending or self._closed)
+                    if not self._pending:
+                        return
+                    burst_started = True
+                else:
+                    burst_started = False
+            if burst_started and not self._closed:
+                # Give a burst of changes a moment to pile up
+                time.sleep(self.delay)
+            with self._cond:
+                key, (df, ops) = self._pending.popitem(last=False)
+                self._writing = key
+            try:
+                self.backend.commit(key, df, ops)
+            except Exception:
+                logger.exception("Background write for %s failed, retrying", key)
+                with self._cond:
+                    # Changes queued meanwhile bring a newer table
+                    df, newer = self._pending.pop(key, (df, []))
+                    self._pending[key] = (df, ops + newer)
+                    self._pending.move_to_end(key, last=False)
+                time.sleep(max(self.delay, 1))
+            finally:
+                with self._cond:
+                    self._writing = None
+                    self._cond.notify_all()
+
+
+## Shared task cache
+# Process-wide map of user_id -> open task store, so every session and browser
+# tab for a user works on the same parsed tasks instead of loading its own
+# copy. Stores write through to storage on every change and bump their data
+# version, which is all other sessions need to notice. A store whose data was
+# changed by another process is reopened on the next get(). The least recently
+# used users are dropped once the cache holds more than max_users users or
+# max_rows tasks in total.
+class TaskCache:
+    def __init__(self, storage, max_users=100, max_rows=1_000_000):
+        self.storage = storage
+        self.max_users = max_users
+        self.max_rows = max_rows
+        self._stores = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, user_id):
+        store = self._stores.get(user_id)
+        if store is not None:
+            self._stores.move_to_end(user_id)
+        return store
+
+    def get(self, user_id):
+        with self._lock:
+            store = self._lookup(user_id)
+        if store is not None and not store.is_stale():
+            return store
+        with self._lock:
+            loading = self._loading.setdefault(user_id, threading.Lock())
+
+        # Load outside the cache lock, but only once per user
+        with loading:
+            with self._lock:
+                store = self._lookup(user_id)
+            if store is None or store.is_stale():
+                store = self.storage.open(user_id)
+                with self._lock:
+                    self._stores[user_id] = store
+                    self._loading.pop(user_id, None)
+                    self._evict()
+        return store
+
+    def _evict(self):
+        rows = sum(len(store) for store in self._stores.values())
+        while len(self._stores) > 1 and (len(self._stores) > self.max_users or rows > self.max_rows):
+            _, store = self._stores.popitem(last=False)
+            rows -= len(store)
+
+
+## User data on disk
+# Every backend names a user's data after their user id: tasks_<id>.csv,
+# .journal and .arrow (each with a .lock file), the <id>/ month folder,
+# recurring_<id>.json, archive_<id>.csv.gz and the id's rows in tasks.db. These find every id
+# with data in a folder and move one id's data to another, whichever
+# backends wrote it.
+USER_FILE_SUFFIXES = (".csv", ".journal", ".arrow")
+
+def stored_user_ids(folder):
+    folder = Path(folder)
+    user_ids = set()
+    for path in folder.iterdir():
+        if path.is_dir():
+            if path.suffix != ".tmp" and any(path.glob("*.summary.json")):
+                user_ids.add(path.name)
+        elif path.name.startswith("tasks_") and path.suffix in USER_FILE_SUFFIXES:
+            user_ids.add(path.stem[len("tasks_"):])
+        elif path.name.startswith("recurring_") and path.suffix == ".json":
+            user_ids.add(path.stem[len("recurring_"):])
+        elif path.name.startswith("archive_") and path.name.endswith(".csv.gz"):
+            user_ids.add(path.name[len("archive_"):-len(".csv.gz")])
+    db_path = folder / "tasks.db"
+    if db_path.exists():
+        with closing(sqlite3.connect(db_path)) as conn:
+            user_ids.update(row[0] for row in conn.execute("SELECT DISTINCT user_id FROM tasks"))
+    return user_ids
+
+def rename_user_data(folder, old_id, new_id):
+    folder = Path(folder)
+    names = [f"tasks_{{}}{suffix}" for suffix in USER_FILE_SUFFIXES] + ["recurring_{}.json", "archive_{}.csv.gz", "{}"]
+    for name in names:
+        old, new = folder / name.format(old_id), folder / name.format(new_id)
+        if old.exists():
+            os.replace(old, new)
+        # Lock files are recreated on demand
+        Path(f"{old}.lock").unlink(missing_ok=True)
+    db_path = folder / "tasks.db"
+    if db_path.exists():
+        with closing(sqlite3.connect(db_path)) as conn, conn:
+            for table in ("tasks", "csv_imports", "user_versions"):
+                conn.execute(f"UPDATE {table} SET user_id = ? WHERE user_id = ?", (new_id, old_id))
+
+
+def _cut_torn_line(path, chunk=1 << 16):
+    # Truncates a file back to just after its last newline
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        keep = 0
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            pos = start
+        if keep < end:
+            f.truncate(keep)
+            f.flush()
+            os.fsync(f.fileno())
+
+def _write_durably(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+STORAGE_BACKENDS = {
+    "csv": CsvStorage,
+    "journal": JournalStorage,
+    "arrow": ArrowStorage,
+    "partitioned": PartitionedStorage,
+    "sqlite": SqliteStorage,
+}
+
+def get_storage(name, folder):
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend {name!r}, expected one of {sorted(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[name](folder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Task storage maintenance")
+    parser.add_argument("command", choices=["migrate-sqlite"])
+    parser.add_argument("--folder", default="user_tasks")
+    args = parser.parse_args()
+
+    if args.command == "migrate-sqlite":
+        users = SqliteStorage(args.folder).migrate_csv_files()
+        print(f"Imported tasks for {len(users)} user(s) into {Path(args.folder) / 'tasks.db'}")
@@ -0,0 +1,239 @@
+import argparse
+import io
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from calendar_view import priority_colors
+from storage import DATE_FORMAT, STORAGE_BACKENDS, TASK_COLUMNS, get_storage, to_app_format
+
+CHUNK_ROWS = 10_000
+FORMATS = ["csv", "json", "ics"]
+
+# Header names other systems use for our columns (matched case-insensitively)
+COLUMN_ALIASES = {
+    "task": "Task", "title": "Task", "name": "Task", "summary": "Task",
+    "category": "Category", "categories": "Category", "list": "Category",
+    "due date": "Due Date", "due_date": "Due Date", "due": "Due Date", "date": "Due Date",
+    "priority": "Priority", "time": "Priority",
+    "completed": "Completed", "done": "Completed",
+    "description": "Description", "notes": "Description",
+    "id": "ID", "uid": "ID",
+}
+TRUE_VALUES = {"true", "1", "yes", "y", "x", "done", "completed"}
+
+def detect_format(file_name):
+    suffix = Path(file_name).suffix.lower().lstrip(".")
+    fmt = {"jsonl": "json", "ndjson": "json", "ical": "ics"}.get(suffix, suffix)
+    if fmt not in FORMATS:
+        raise ValueError(f"Can't tell the format of {file_name!r}, expected one of {FORMATS}")
+    return fmt
+
+def _text(source):
+    # Paths, text streams and binary streams (like streamlit uploads)
+    if isinstance(source, (str, Path)):
+        return open(source, encoding="utf-8-sig", newline="")
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+
+
+## Readers
+# Each yields frames of at most chunk_rows raw rows, so only one chunk of
+# the input is held as text at a time.
+def read_csv_chunks(source, chunk_rows=CHUNK_ROWS):
+    yield from pd.read_csv(_text(source), chunksize=chunk_rows, dtype=object)
+
+def read_json_chunks(source, chunk_rows=CHUNK_ROWS):
+    # JSON Lines is streamed; a single JSON array has to be parsed whole
+    f = _text(source)
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+    if first == "[":
+        records = json.loads(first + f.read())
+        for start in range(0, len(records), chunk_rows):
+            yield pd.DataFrame(records[start:start + chunk_rows])
+        return
+    rows = []
+    for line in _prepend(first, f):
+        if line.strip():
+            rows.append(json.loads(line))
+        if len(rows) == chunk_rows:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+def _prepend(first, f):
+    lines = iter(f)
+    yield first + next(lines, "")
+    yield from lines
+
+def read_ics_chunks(source, chunk_rows=CHUNK_ROWS):
+    # VTODO and VEVENT components; folded lines are joined back up
+    rows, component, props = [], None, {}
+    for line in _unfold(_text(source)):
+        name, _, value = line.partition(":")
+        name = name.split(";", 1)[0].upper()
+        if name == "BEGIN" and value.upper() in ("VTODO", "VEVENT"):
+            component, props = value.upper(), {}
+        elif name == "END" and value.upper() == component:
+            rows.append(_ics_task(props))
+            component = None
+            if len(rows) == chunk_rows:
+                yield pd.DataFrame(rows)
+                rows = []
+        elif component is not None:
+            props.setdefault(name, value)
+    if rows:
+        yield pd.DataFrame(rows)
+
+def _unfold(lines):
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+def _ics_task(props):
+    due = props.get("DUE") or props.get("DTSTART")
+    return {
+        "Task": _ics_unescape(props.get("SUMMARY", "")),
+        "Category": _ics_unescape(props["CATEGORIES"].split(",")[0]) if "CATEGORIES" in props else None,
+        "Due Date": due[:8] if due else None,
+        "Priority": _ics_unescape(props.get("X-TODO-TIME", "")) or None,
+        "Completed": props.get("STATUS", "").upper() == "COMPLETED" or "COMPLETED" in props,
+        "Description": _ics_unescape(props.get("DESCRIPTION", "")) or None,
+        "ID": props.get("UID"),
+    }
+
+def _ics_unescape(value):
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+def _ics_escape(value):
+    return str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+READERS = {"csv": read_csv_chunks, "json": read_json_chunks, "ics": read_ics_chunks}
+
+
+## Validation
+def normalize(chunk):
+    # Maps a raw chunk onto the task columns. Returns (tasks, rejected): rows
+    # without a name or with an unreadable due date are rejected, unknown
+    # times are dropped, and due dates come out parsed.
+    chunk = chunk.rename(columns=lambda col: COLUMN_ALIASES.get(str(col).strip().lower(), col))
+    chunk = chunk.loc[:, ~chunk.columns.duplicated()].reindex(columns=TASK_COLUMNS)
+
+    names = chunk["Task"].astype(object).where(chunk["Task"].notna(), "").astype(str).str.strip()
+    raw_due = chunk["Due Date"].astype(object).where(chunk["Due Date"].notna(), None)
+    due = _parse_dates(raw_due)
+    keep = (names != "") & (due.notna() | raw_due.isna() | (raw_due.astype(str).str.strip() == ""))
+
+    completed = chunk["Completed"]
+    if completed.dtype != bool:
+        completed = completed.astype(object).where(completed.notna(), "").astype(str).str.strip().str.lower().isin(TRUE_VALUES)
+    tasks = pd.DataFrame({
+        "Task": names.astype(object),
+        "Category": _text_column(chunk["Category"]),
+        "Due Date": due,
+        "Priority": chunk["Priority"].where(chunk["Priority"].isin(list(priority_colors))).astype(object),
+        "Completed": completed.astype(bool),
+        "Description": _text_column(chunk["Description"]),
+        "ID": _text_column(chunk["ID"]),
+    })
+    return tasks[keep].reset_index(drop=True), int((~keep).sum())
+
+def _parse_dates(values):
+    # The app's own format first, then ISO and iCalendar's basic form
+    text = values.astype(str).str.strip()
+    due = pd.to_datetime(text, format=DATE_FORMAT, errors="coerce")
+    for fmt in ("%Y-%m-%d", "%Y%m%d"):
+        due = due.fillna(pd.to_datetime(text, format=fmt, errors="coerce"))
+    return due.where(values.notna())
+
+def _text_column(values):
+    text = values.astype(object).where(values.notna(), None)
+    return text.map(lambda v: None if v is None or str(v).strip() == "" else str(v).strip(), na_action="ignore")
+
+
+## Import and export
+def import_tasks(task_store, source, fmt, chunk_rows=CHUNK_ROWS):
+    # Streams and validates the input chunk by chunk, then adds everything
+    # in one batch, so storage sees a single write. Returns (added, rejected).
+    frames, rejected = [], 0
+    for chunk in READERS[fmt](source, chunk_rows):
+        tasks, bad = normalize(chunk)
+        frames.append(tasks)
+        rejected += bad
+    if not frames:
+        return 0, rejected
+    added = task_store.add_many(pd.concat(frames, ignore_index=True))
+    return len(added), rejected
+
+def iter_export(tasks, fmt, chunk_rows=CHUNK_ROWS):
+    # Yields the export as text pieces of at most chunk_rows tasks each
+    tasks = tasks.reindex(columns=TASK_COLUMNS)
+    if fmt == "ics":
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//to_do//EN\r\n"
+    for start in range(0, len(tasks), chunk_rows):
+        chunk = to_app_format(tasks.iloc[start:start + chunk_rows])
+        if fmt == "csv":
+            yield chunk.to_csv(index=False, header=start == 0)
+        elif fmt == "json":
+            yield chunk.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+        else:
+            yield "".join(_ics_todo(task) for task in chunk.itertuples(index=False))
+    if fmt == "csv" and tasks.empty:
+        yield ",".join(TASK_COLUMNS) + "\n"
+    if fmt == "ics":
+        yield "END:VCALENDAR\r\n"
+
+def _ics_todo(task):
+    task = dict(zip(TASK_COLUMNS, task))
+    lines = ["BEGIN:VTODO", f"UID:{task['ID']}", f"SUMMARY:{_ics_escape(task['Task'])}"]
+    if pd.notna(task["Due Date"]):
+        lines.append(f"DUE;VALUE=DATE:{pd.to_datetime(task['Due Date'], format=DATE_FORMAT):%Y%m%d}")
+    if pd.notna(task["Category"]):
+        lines.append(f"CATEGORIES:{_ics_escape(task['Category'])}")
+    if pd.notna(task["Priority"]):
+        lines.append(f"X-TODO-TIME:{_ics_escape(task['Priority'])}")
+    if pd.notna(task["Description"]) and task["Description"]:
+        lines.append(f"DESCRIPTION:{_ics_escape(task['Description'])}")
+    lines.append("STATUS:COMPLETED" if task["Completed"] else "STATUS:NEEDS-ACTION")
+    lines.append("END:VTODO")
+    return "\r\n".join(lines) + "\r\n"
+
+def export_tasks(tasks, out, fmt, chunk_rows=CHUNK_ROWS):
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        for piece in iter_export(tasks, fmt, chunk_rows):
+            f.write(piece)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import or export a user's tasks")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file")
+    parser.add_argument("--user-id", required=True, help="storage key of the user, see python users.py list")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file name")
+    parser.add_argument("--backend", default=os.environ.get("TODO_STORAGE", "csv"), choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--folder", default="user_tasks")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+    task_store = get_storage(args.backend, args.folder).open(args.user_id)
+    if args.command == "import":
+        added, rejected = import_tasks(task_store, args.file, fmt, args.chunk_rows)
+        print(f"Imported {added} task(s) for {args.user_id}, rejected {rejected} invalid row(s)")
+    else:
+        export_tasks(task_store.tasks, args.file, fmt, args.chunk_rows)
+        print(f"Exported {len(task_store)} task(s) for {args.user_id} to {args.file}")
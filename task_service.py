@@ -0,0 +1,434 @@
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+
+from analytics import workload_frame
+from archive import ArchivedStorage
+from recurrence import RecurringStorage
+from search import SearchHit
+from storage import STORAGE_BACKENDS, TASK_COLUMNS, TaskCache, _to_iso, empty_tasks, get_storage
+from task_store import CategorySummary, data_versions
+
+logger = logging.getLogger("to_do.service")
+
+## Wire format
+# Frames travel as {"index": [...], "columns": {name: [...]}} with due dates
+# as ISO text, so row keys (task IDs, SQLite ids, "<month>/<id>") survive
+# the round trip unchanged.
+def frame_to_json(df):
+    df = df.reindex(columns=TASK_COLUMNS)
+    columns = {col: df[col].astype(object).where(df[col].notna(), None).tolist() for col in TASK_COLUMNS}
+    columns["Due Date"] = _to_iso(df["Due Date"]).tolist()
+    columns["Completed"] = df["Completed"].fillna(False).astype(bool).tolist()
+    return {"index": df.index.tolist(), "columns": columns}
+
+def frame_from_json(data):
+    if not data["index"]:
+        return empty_tasks()
+    df = pd.DataFrame(data["columns"], index=data["index"], columns=TASK_COLUMNS)
+    df["Due Date"] = pd.to_datetime(df["Due Date"], format="%Y-%m-%d", errors="coerce")
+    df["Completed"] = df["Completed"].astype(bool)
+    return df
+
+
+## Service
+# One process owns the storage backend (and the repeating-task rules) and a
+# TaskCache of open stores, and every app replica talks to it over HTTP. Requests run on a fixed pool of
+# worker threads; each keeps its own SQLite connection, so the pool size is
+# also the number of database connections. Reads come in batches (one
+# request answers everything a rerun needs), and changes come in batches
+# applied in order under the user's store lock.
+READS = {
+    "tasks_on", "count_on", "tasks_between", "category_overview", "search", "tasks", "len", "recurring_rules",
+    "archived_between", "search_archived", "workload_between", "first_due_date", "archived_categories",
+}
+HITS = {"search", "search_archived"}
+
+class TaskService:
+    def __init__(self, storage, folder, archive_after_days=90):
+        self.cache = TaskCache(RecurringStorage(ArchivedStorage(storage, folder, archive_after_days), folder))
+        # Versions are only unique within one service process
+        self.instance = uuid.uuid4().hex[:8]
+
+    def version(self, store):
+        return f"{self.instance}:{store.version}"
+
+    def read(self, user_id, calls):
+        store = self.cache.get(user_id)
+        with store.lock:
+            return {"version": self.version(store), "results": [self._read(store, *call) for call in calls]}
+
+    def _read(self, store, name, *args):
+        if name not in READS:
+            raise ValueError(f"Unknown read {name!r}")
+        if name == "len":
+            return len(store)
+        if name == "recurring_rules":
+            return store.recurring_rules()
+        if name == "first_due_date":
+            first = store.first_due_date()
+            return None if first is None else first.isoformat()
+        if name == "tasks":
+            return frame_to_json(store.tasks)
+        if name in ("category_overview", "archived_categories"):
+            return [[cat.name, int(cat.total), int(cat.open), list(cat.tasks)] for cat in getattr(store, name)()]
+        if name in HITS:
+            return [
+                [hit.id, hit.task, hit.category if isinstance(hit.category, str) else None,
+                 None if hit.due is None else hit.due.date().isoformat(), hit.completed, hit.score]
+                for hit in getattr(store, name)(*args)
+            ]
+        days = [date.fromisoformat(arg) for arg in args[:2 if name.endswith("_between") else 1]]
+        result = getattr(store, name)(*days, *args[len(days):])
+        if name == "workload_between":
+            return result.to_numpy().tolist()
+        return result if name == "count_on" else frame_to_json(result)
+
+    def change(self, user_id, ops, calls=()):
+        # calls are read after the changes, in the same request
+        store = self.cache.get(user_id)
+        results = []
+        with store.lock:
+            for op, *args in ops:
+                if op == "add":
+                    store.add(args[0])
+                elif op == "add_many":
+                    results.append(frame_to_json(store.add_many(frame_from_json(args[0]))))
+                elif op == "set_completed":
+                    store.set_completed(*args)
+                elif op == "delete":
+                    store.delete(*args)
+                elif op == "delete_many":
+                    store.delete_many(*args)
+                elif op == "add_recurring":
+                    results.append(store.add_recurring(*args))
+                elif op == "remove_recurring":
+                    store.remove_recurring(*args)
+                else:
+                    raise ValueError(f"Unknown change {op!r}")
+            reads = [self._read(store, *call) for call in calls]
+            return {"version": self.version(store), "results": results, "reads": reads}
+
+
+class _NotFound(Exception):
+    pass
+
+class _Handler(BaseHTTPRequestHandler):
+    # GET  /users/<id>/version
+    # POST /users/<id>/read     {"calls": [[name, *args], ...]}
+    # POST /users/<id>/changes  {"ops": [[op, *args], ...], "calls": [...]}
+    def _route(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "users":
+            raise _NotFound(self.path)
+        user_id = urllib.parse.unquote(parts[1])
+        # The id names the user's files, so it must stay one plain file name
+        if not user_id or user_id.startswith(".") or any(c in user_id for c in "/\\\0") or ".." in user_id:
+            raise ValueError(f"Invalid user id {user_id!r}")
+        return user_id, parts[2]
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, body=None):
+        service = self.server.service
+        try:
+            user_id, action = self._route()
+            if action == "version" and body is None:
+                self._reply(200, {"version": service.version(service.cache.get(user_id))})
+            elif action == "read" and body is not None:
+                self._reply(200, service.read(user_id, body["calls"]))
+            elif action == "changes" and body is not None:
+                self._reply(200, service.change(user_id, body["ops"], body.get("calls", [])))
+            else:
+                raise _NotFound(self.path)
+        except _NotFound:
+            self._reply(404, {"error": f"No such endpoint: {self.command} {self.path}"})
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("Request %s %s failed", self.command, self.path)
+            self._reply(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    # Like ThreadingHTTPServer, but on a fixed set of reused threads
+    def __init__(self, address, service, pool_size=8):
+        # Made first: a failed bind calls server_close() from inside __init__
+        self.pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="task-service")
+        super().__init__(address, _Handler)
+        self.service = service
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+## Client
+# Storage backend for the app that forwards to a running service. A store's
+# reads are cached until the service reports a new version for the user. The
+# version is asked for at most once every version_ttl seconds, however many
+# times a rerun looks the store up, so an unchanged rerun costs at most one
+# small version request and another replica's changes show up within that.
+# Changes that return nothing (add, tick off, delete) are queued and go out
+# with the next request for the user, which also refetches the reads the
+# page made recently, so a change and the rerun after it share one round
+# trip. A request that fails drops the changes it carried, as a failed
+# change always did.
+class ServiceError(RuntimeError):
+    pass
+
+class RemoteStorage:
+    def __init__(self, url, timeout=10, version_ttl=1.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._queued = {}
+        self._queue_lock = threading.Lock()
+
+    def request(self, user_id, action, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        req = urllib.request.Request(
+            f"{self.url}/users/{urllib.parse.quote(user_id, safe='')}/{action}", data=data, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read()).get("error", str(e))
+            # Bad requests (like an unreadable repeat rule) are the caller's error
+            raise (ValueError if e.code == 400 else ServiceError)(message) from e
+
+    def queue(self, user_id, op):
+        with self._queue_lock:
+            self._queued.setdefault(user_id, []).append(list(op))
+
+    def has_queued(self, user_id):
+        with self._queue_lock:
+            return user_id in self._queued
+
+    def send(self, user_id, ops=(), calls=()):
+        # The user's queued changes and ops, then calls, in one request.
+        # Returns the version and the results of ops and of calls ("reads").
+        with self._queue_lock:
+            ops = self._queued.pop(user_id, []) + [list(op) for op in ops]
+        calls = [list(call) for call in calls]
+        if ops:
+            return self.request(user_id, "changes", {"ops": ops, "calls": calls})
+        response = self.request(user_id, "read", {"calls": calls})
+        return {"version": response["version"], "results": [], "reads": response["results"]}
+
+    def open(self, user_id):
+        return RemoteTaskStore(self, user_id)
+
+    def flush(self, key=None, timeout=None):
+        # Changes are acknowledged once sent, so flushing sends what's queued
+        with self._queue_lock:
+            user_ids = [key] if key is not None else list(self._queued)
+        for user_id in user_ids:
+            if self.has_queued(user_id):
+                self.send(user_id)
+        return True
+
+
+# How many distinct recent reads a store refetches after a change
+RECENT_READS = 24
+
+class RemoteTaskStore:
+    def __init__(self, storage, user_id):
+        self.storage = storage
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self._cache = {}
+        # The reads made lately, most recent last: what a rerun asks for
+        self._recent = OrderedDict()
+        self._remote_version = None
+        # One round trip for what every rerun needs
+        self._read(("len",), ("category_overview",))
+        self._checked, self._stale = time.monotonic(), False
+
+    def _read(self, *calls, ops=()):
+        # Recent reads the cache lost (to a change) are fetched along
+        with self.lock:
+            calls = list(dict.fromkeys([*calls, *(call for call in self._recent if call not in self._cache)]))
+        sending = bool(ops) or self.storage.has_queued(self.user_id)
+        response = self.storage.send(self.user_id, ops, calls)
+        with self.lock:
+            if response["version"] != self._remote_version:
+                self._remote_version = response["version"]
+                if not sending:
+                    # Someone else's change; our own already moved version
+                    self.version = next(data_versions)
+                    self._cache = {}
+            self._cache.update(zip(calls, response["reads"]))
+        return response
+
+    def _cached(self, *call):
+        with self.lock:
+            if call[0] != "tasks":
+                self._recent[call] = None
+                self._recent.move_to_end(call)
+                if len(self._recent) > RECENT_READS:
+                    self._recent.popitem(last=False)
+            if call in self._cache:
+                return self._cache[call]
+            if len(self._cache) > 256:
+                self._cache = {}
+        return self._read(call)["reads"][0]
+
+    def _changed(self):
+        with self.lock:
+            self.version = next(data_versions)
+            self._cache = {}
+
+    def _change(self, *ops):
+        # Changes with results go out at once, with anything queued before
+        self._changed()
+        return self._read(ops=ops)["results"]
+
+    def _queue(self, op):
+        self.storage.queue(self.user_id, op)
+        self._changed()
+
+    def is_stale(self):
+        if self.storage.has_queued(self.user_id):
+            # Send our changes now; the rerun's reads come back with them
+            self._read()
+            return False
+        with self.lock:
+            if self._stale or time.monotonic() - self._checked < self.storage.version_ttl:
+                return self._stale
+        version = self.storage.request(self.user_id, "version")["version"]
+        with self.lock:
+            # A store once stale stays stale; the cache opens a new one
+            self._checked, self._stale = time.monotonic(), version != self._remote_version
+            return self._stale
+
+    ## Reads
+    def __len__(self):
+        return self._cached("len")
+
+    @property
+    def tasks(self):
+        return frame_from_json(self._cached("tasks"))
+
+    def tasks_on(self, day, start=0, stop=None):
+        return frame_from_json(self._cached("tasks_on", day.isoformat(), start, stop))
+
+    def count_on(self, day):
+        return self._cached("count_on", day.isoformat())
+
+    def tasks_between(self, start, end):
+        return frame_from_json(self._cached("tasks_between", start.isoformat(), end.isoformat()))
+
+    def category_overview(self):
+        return [CategorySummary(*cat) for cat in self._cached("category_overview")]
+
+    def recurring_rules(self):
+        return self._cached("recurring_rules")
+
+    def archived_between(self, start, end):
+        return frame_from_json(self._cached("archived_between", start.isoformat(), end.isoformat()))
+
+    def archived_categories(self):
+        return [CategorySummary(*cat) for cat in self._cached("archived_categories")]
+
+    def workload_between(self, start, end):
+        return workload_frame(start, end, self._cached("workload_between", start.isoformat(), end.isoformat()))
+
+    def first_due_date(self):
+        first = self._cached("first_due_date")
+        return None if first is None else date.fromisoformat(first)
+
+    def _hits(self, name, query, limit):
+        return [
+            SearchHit(task_id, task, category, None if due is None else pd.Timestamp(due), completed, score)
+            for task_id, task, category, due, completed, score in self._cached(name, query, limit)
+        ]
+
+    def search(self, query, limit=20):
+        return self._hits("search", query, limit)
+
+    def search_archived(self, query, limit=20):
+        return self._hits("search_archived", query, limit)
+
+    ## Changes
+    def add(self, task):
+        self._queue(("add", task))
+
+    def add_many(self, tasks):
+        return frame_from_json(self._change(("add_many", frame_to_json(tasks)))[0])
+
+    def set_completed(self, key, completed):
+        self._queue(("set_completed", key, bool(completed)))
+
+    def delete(self, key):
+        self._queue(("delete", key))
+
+    def delete_many(self, keys):
+        self._queue(("delete_many", list(keys)))
+
+    def add_recurring(self, task, rrule):
+        return self._change(("add_recurring", task, rrule))[0]
+
+    def remove_recurring(self, rule_id):
+        self._change(("remove_recurring", rule_id))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve users' tasks to app replicas over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", default="sqlite", choices=sorted(STORAGE_BACKENDS))
+    parser.add_argument("--folder", default="user_tasks")
+    parser.add_argument("--pool-size", type=int, default=8, help="worker threads, and so database connections")
+    parser.add_argument("--archive-after-days", type=int, default=90, help="0 keeps completed tasks live forever")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = TaskService(get_storage(args.backend, args.folder), args.folder, args.archive_after_days)
+    server = PooledHTTPServer((args.host, args.port), service, args.pool_size)
+    logger.info("Serving %s storage in %s on http://%s:%d", args.backend, args.folder, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,406 @@
+import itertools
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from analytics import WorkloadRollup
+from search import SearchIndex
+
+# Process-wide data version numbers. Every store draws a fresh one whenever its
+# data changes, so (user, version) never names two different states.
+data_versions = itertools.count(1)
+
+COLUMN_DTYPES = {
+    "Task": object,
+    "Category": object,
+    "Due Date": "datetime64[ns]",
+    "Priority": object,
+    "Completed": bool,
+    "Description": object,
+    "ID": object,
+}
+
+def new_task_id():
+    return uuid.uuid4().hex[:12]
+
+def new_task_ids(count):
+    # Same shape as new_task_id(), drawn in one go for bulk adds
+    digits = os.urandom(6 * count).hex()
+    return [digits[i:i + 12] for i in range(0, 12 * count, 12)]
+
+def ensure_ids(tasks):
+    # Tasks saved before IDs existed get one from their row position. That is
+    # the same in every process reading the same file, and sticks once saved.
+    if "ID" in tasks and tasks["ID"].notna().all():
+        return tasks
+    ids = tasks["ID"] if "ID" in tasks else pd.Series(np.nan, index=tasks.index, dtype=object)
+    fallback = pd.Series([f"row{i}" for i in range(len(tasks))], index=tasks.index, dtype=object)
+    return tasks.assign(ID=ids.astype(object).where(ids.notna(), fallback))
+
+def apply_ops(tasks, ops):
+    # Replays change records on a task table, matching tasks by ID. Used to
+    # merge our changes into a version someone else saved in the meantime.
+    tasks = ensure_ids(tasks)
+    for op, *args in ops:
+        if op == "add":
+            task = args[0]
+            if not (tasks["ID"] == task["ID"]).any():
+                tasks = pd.concat([tasks, pd.DataFrame([task])], ignore_index=True)
+        elif op == "add_many":
+            batch = args[0]
+            tasks = pd.concat([tasks, batch[~batch["ID"].isin(tasks["ID"])]], ignore_index=True)
+        elif op == "set_completed":
+            task_id, completed = args
+            tasks = tasks.assign(Completed=tasks["Completed"].where(tasks["ID"] != task_id, completed))
+        elif op == "delete":
+            tasks = tasks[tasks["ID"] != args[0]].reset_index(drop=True)
+        elif op == "delete_many":
+            tasks = tasks[~tasks["ID"].isin(args[0])].reset_index(drop=True)
+    return tasks
+
+## Category rollup
+# Per-category task count, open count and task names, kept up to date as
+# tasks change so the sidebar never has to scan the task table.
+CategorySummary = namedtuple("CategorySummary", ["name", "total", "open", "tasks"])
+
+class CategoryRollup:
+    def __init__(self, tasks=None):
+        # tasks: frame with Category, Task and Completed columns
+        self.total, self.open, self.names = Counter(), Counter(), defaultdict(list)
+        if tasks is None:
+            return
+        tasks = tasks.dropna(subset=["Category"])
+        self.total.update(tasks["Category"].value_counts().to_dict())
+        self.open.update(tasks.loc[~tasks["Completed"].astype(bool), "Category"].value_counts().to_dict())
+        self.names.update(tasks.groupby("Category", sort=False)["Task"].agg(list).to_dict())
+
+    def state(self):
+        return {
+            "total": {cat: int(n) for cat, n in self.total.items()},
+            "open": {cat: int(n) for cat, n in self.open.items()},
+            "names": dict(self.names),
+        }
+
+    def merge(self, state):
+        # Folds in another rollup's state(), e.g. one saved per partition
+        for cat, n in state["total"].items():
+            self.total[cat] += n
+            self.open[cat] += state["open"].get(cat, 0)
+            self.names[cat].extend(state["names"][cat])
+
+    def add(self, category, name, completed):
+        if pd.isna(category):
+            return
+        self.total[category] += 1
+        self.open[category] += not completed
+        self.names[category].append(name)
+
+    def remove(self, category, name, completed):
+        if pd.isna(category):
+            return
+        self.total[category] -= 1
+        self.open[category] -= not completed
+        self.names[category].remove(name)
+        if not self.total[category]:
+            del self.total[category], self.open[category], self.names[category]
+
+    def set_completed(self, category, was_completed, completed):
+        if pd.isna(category) or bool(was_completed) == bool(completed):
+            return
+        self.open[category] += 1 if was_completed else -1
+
+    def overview(self):
+        return [
+            CategorySummary(cat, self.total[cat], self.open[cat], self.names[cat])
+            for cat in sorted(self.total)
+        ]
+
+
+## In-memory task store
+# Holds a user's tasks for the session in one preallocated array per column,
+# with due dates parsed to datetime64 once at load. Appends fill spare
+# capacity (doubling when full), so adding a task is amortized O(1), and a
+# per-day index of row positions lets the calendar and day list read just the
+# rows they show. Frames handed out are read-only views, not copies; changes
+# to rows a view may cover (ticking off, deletes) write fresh arrays instead
+# of editing the buffers in place, so a frame handed out never changes.
+# Changes go through add/set_completed/delete, which also hand them to the
+# storage backend. Rows are keyed by their task ID, which stays put while
+# other rows come and go. A store may be shared by several sessions, so reads
+# and changes take its lock. The search index is built on the first search
+# and kept up to date from then on.
+class TaskStore:
+    def __init__(self, tasks, storage=None, user_id=None):
+        self.storage = storage
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self.version = next(data_versions)
+        self._size = len(tasks)
+        self._columns = {}
+        tasks = ensure_ids(tasks)
+        for col, dtype in COLUMN_DTYPES.items():
+            buf = np.empty(max(16, self._size), dtype=dtype)
+            buf[:self._size] = _parse_column(tasks, col)
+            self._columns[col] = buf
+        self._build_day_index()
+        self._positions_by_id = {task_id: pos for pos, task_id in enumerate(self._columns["ID"][:self._size])}
+        self.categories = CategoryRollup(self.tasks)
+        self.workload = WorkloadRollup(self.tasks)
+        self._search = None
+
+    def _build_day_index(self):
+        days = _day_numbers(self._columns["Due Date"][:self._size])
+        valid = np.flatnonzero(days != _NO_DAY)
+        order = valid[np.argsort(days[valid], kind="stable")]
+        bounds = np.flatnonzero(np.diff(days[order])) + 1
+        self._by_day = {
+            int(days[chunk[0]]): chunk.tolist()
+            for chunk in np.split(order, bounds) if len(chunk)
+        }
+
+    def __len__(self):
+        return self._size
+
+    ## Read-only views
+    @property
+    def tasks(self):
+        with self.lock:
+            return pd.DataFrame(
+                {col: _read_only(buf[:self._size]) for col, buf in self._columns.items()},
+                copy=False,
+            )
+
+    def _take(self, positions):
+        positions = np.asarray(positions, dtype=np.intp)
+        ids = self._columns["ID"][positions]
+        return pd.DataFrame(
+            {col: pd.Series(buf[positions], index=ids, dtype=buf.dtype) for col, buf in self._columns.items()},
+            index=ids,
+        )
+
+    def _positions(self, start, end):
+        first = int(np.datetime64(start, "D").astype(np.int64))
+        last = int(np.datetime64(end, "D").astype(np.int64))
+        if last - first < len(self._by_day):
+            buckets = (self._by_day.get(d, ()) for d in range(first, last + 1))
+        else:
+            buckets = (rows for d, rows in self._by_day.items() if first <= d <= last)
+        return sorted(itertools.chain.from_iterable(buckets))
+
+    def tasks_on(self, day, start=0, stop=None):
+        # start/stop pick a slice of the day's tasks, for paging long lists
+        with self.lock:
+            return self._take(self._positions(day, day)[start:stop])
+
+    def count_on(self, day):
+        with self.lock:
+            return len(self._by_day.get(int(np.datetime64(day, "D").astype(np.int64)), ()))
+
+    def tasks_between(self, start, end):
+        with self.lock:
+            return self._take(self._positions(start, end))
+
+    def completed_between(self, start, end):
+        tasks = self.tasks_between(start, end)
+        return tasks[tasks["Completed"]]
+
+    def category_overview(self):
+        with self.lock:
+            return self.categories.overview()
+
+    def workload_between(self, start, end):
+        with self.lock:
+            return self.workload.between(start, end)
+
+    def first_due_date(self):
+        with self.lock:
+            return self.workload.first_day()
+
+    def search(self, query, limit=20):
+        with self.lock:
+            if self._search is None:
+                self._search = SearchIndex(self.tasks)
+            return self._search.search(query, limit)
+
+    def is_stale(self):
+        # True once the storage has seen changes made outside this store
+        return self.storage is not None and self.storage.changed(self.user_id)
+
+    ## Changes
+    def _reserve(self, rows):
+        capacity = len(self._columns["Task"])
+        if self._size + rows <= capacity:
+            return
+        while self._size + rows > capacity:
+            capacity *= 2
+        for col, buf in self._columns.items():
+            grown = np.empty(capacity, dtype=buf.dtype)
+            grown[:self._size] = buf[:self._size]
+            self._columns[col] = grown
+
+    def _compact(self, keep):
+        # Kept rows go into new buffers; frames handed out keep the old ones
+        size = int(keep.sum())
+        for col, buf in self._columns.items():
+            fresh = np.empty_like(buf)
+            fresh[:size] = buf[:self._size][keep]
+            self._columns[col] = fresh
+        self._size = size
+
+    def add(self, task):
+        task = {**task, "ID": task.get("ID") or new_task_id()}
+        with self.lock:
+            pos = self._size
+            self._reserve(1)
+            for col, buf in self._columns.items():
+                value = task.get(col)
+                if col == "Due Date":
+                    value = pd.to_datetime(value, errors="coerce")
+                    value = np.datetime64("NaT") if pd.isna(value) else value.to_datetime64()
+                elif col == "Completed":
+                    value = bool(value)
+                buf[pos] = value
+            self._size += 1
+            day = int(_day_numbers(self._columns["Due Date"][pos:pos + 1])[0])
+            if day != _NO_DAY:
+                self._by_day.setdefault(day, []).append(pos)
+            self._positions_by_id[task["ID"]] = pos
+            self.categories.add(*self._row_summary(pos))
+            self.workload.add(*self._row_workload(pos))
+            if self._search is not None:
+                self._search.add(task)
+            self.version = next(data_versions)
+            if self.storage is not None:
+                self.storage.add(self.user_id, self.tasks, task)
+
+    def add_many(self, tasks):
+        # Bulk add: one buffer growth, one index update and one storage write.
+        # Tasks whose ID is already here are skipped, so re-imports are safe.
+        # Returns the tasks that were added.
+        if "ID" not in tasks:
+            tasks = tasks.assign(ID=None)
+        ids = tasks["ID"].astype(object)
+        missing = ids.isna()
+        ids[missing] = new_task_ids(int(missing.sum()))
+        tasks = tasks.assign(ID=ids).drop_duplicates("ID")
+        with self.lock:
+            tasks = tasks[~tasks["ID"].isin(self._positions_by_id)].reset_index(drop=True)
+            if tasks.empty:
+                return tasks
+            pos, rows = self._size, len(tasks)
+            self._reserve(rows)
+            for col, buf in self._columns.items():
+                buf[pos:pos + rows] = _parse_column(tasks, col)
+            self._size += rows
+            days = _day_numbers(self._columns["Due Date"][pos:pos + rows])
+            for offset in np.flatnonzero(days != _NO_DAY):
+                self._by_day.setdefault(int(days[offset]), []).append(pos + int(offset))
+            self._positions_by_id.update(zip(self._columns["ID"][pos:pos + rows], range(pos, pos + rows)))
+            added = self._take(range(pos, pos + rows)).reset_index(drop=True)
+            self.categories.merge(CategoryRollup(added).state())
+            self.workload.merge(WorkloadRollup(added).state())
+            if self._search is not None:
+                self._search.add_many(added)
+            self.version = next(data_versions)
+            if self.storage is not None:
+                self.storage.add_many(self.user_id, self.tasks, added)
+        return added
+
+    def _row_summary(self, pos):
+        return tuple(self._columns[col][pos] for col in ("Category", "Task", "Completed"))
+
+    def _row_workload(self, pos):
+        return tuple(self._columns[col][pos] for col in ("Due Date", "Priority", "Completed"))
+
+    def row_summary(self, task_id):
+        # (category, name, completed) of a task, or None if it is gone
+        with self.lock:
+            pos = self._positions_by_id.get(task_id)
+            return None if pos is None else self._row_summary(pos)
+
+    def set_completed(self, task_id, completed):
+        with self.lock:
+            pos = self._positions_by_id.get(task_id)
+            if pos is None:
+                return
+            was_completed = self._columns["Completed"][pos]
+            self._columns["Completed"] = done = self._columns["Completed"].copy()
+            done[pos] = completed
+            self.categories.set_completed(self._columns["Category"][pos], was_completed, completed)
+            self.workload.set_completed(*self._row_workload(pos)[:2], was_completed, completed)
+            if self._search is not None:
+                self._search.set_completed(task_id, completed)
+            self.version = next(data_versions)
+            if self.storage is not None:
+                self.storage.set_completed(self.user_id, self.tasks, task_id, completed)
+
+    def delete(self, task_id):
+        with self.lock:
+            pos = self._positions_by_id.pop(task_id, None)
+            if pos is None:
+                return
+            # Copies every row but this one, so this one is O(n)
+            self.categories.remove(*self._row_summary(pos))
+            self.workload.remove(*self._row_workload(pos))
+            keep = np.ones(self._size, dtype=bool)
+            keep[pos] = False
+            self._compact(keep)
+            for day, rows in list(self._by_day.items()):
+                rows = [p - (p > pos) for p in rows if p != pos]
+                if rows:
+                    self._by_day[day] = rows
+                else:
+                    del self._by_day[day]
+            for later_id in self._columns["ID"][pos:self._size]:
+                self._positions_by_id[later_id] -= 1
+            if self._search is not None:
+                self._search.remove(task_id)
+            self.version = next(data_versions)
+            if self.storage is not None:
+                self.storage.delete(self.user_id, self.tasks, task_id)
+
+    def delete_many(self, task_ids):
+        # Bulk delete: one compaction of the columns, one rebuild of the
+        # indexes and one storage write, however many tasks go
+        with self.lock:
+            positions = sorted({self._positions_by_id[t] for t in task_ids if t in self._positions_by_id})
+            if not positions:
+                return
+            deleted = self._columns["ID"][positions].tolist()
+            keep = np.ones(self._size, dtype=bool)
+            keep[positions] = False
+            self._compact(keep)
+            self._build_day_index()
+            self._positions_by_id = {task_id: pos for pos, task_id in enumerate(self._columns["ID"][:self._size])}
+            self.categories = CategoryRollup(self.tasks)
+            self.workload = WorkloadRollup(self.tasks)
+            if self._search is not None:
+                for task_id in deleted:
+                    self._search.remove(task_id)
+            self.version = next(data_versions)
+            if self.storage is not None:
+                self.storage.delete_many(self.user_id, self.tasks, deleted)
+
+
+_NO_DAY = np.iinfo(np.int64).min
+
+def _day_numbers(due):
+    # Days since the epoch; NaT becomes _NO_DAY
+    return due.astype("datetime64[D]").astype(np.int64)
+
+def _parse_column(tasks, col):
+    if col not in tasks:
+        return False if col == "Completed" else None
+    if col == "Due Date":
+        return pd.to_datetime(tasks[col], errors="coerce").to_numpy(dtype="datetime64[ns]")
+    if col == "Completed":
+        return tasks[col].fillna(False).astype(bool).to_numpy()
+    return tasks[col].to_numpy(dtype=object)
+
+def _read_only(values):
+    values.flags.writeable = False
+    return pd.Series(values, dtype=values.dtype, copy=False)
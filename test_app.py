@@ -0,0 +1,31 @@
+import threading
+from pathlib import Path
+
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.testing.v1 import AppTest
+
+APP = str(Path(__file__).with_name("to_do.py"))
+
+def test_export_is_built_off_the_script_thread(tmp_path, monkeypatch):
+    # Streamlit calls a download button's data callable from the request
+    # handler, where there is no session state
+    monkeypatch.chdir(tmp_path)
+    deferred = []
+    add_deferred = MediaFileManager.add_deferred
+    def capture(self, data_callable, *args, **kwargs):
+        deferred.append(data_callable)
+        return add_deferred(self, data_callable, *args, **kwargs)
+    monkeypatch.setattr(MediaFileManager, "add_deferred", capture)
+
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.text_input[0].input("ann")
+    at.text_input[1].input("secret")
+    at.button[0].click().run()
+    at.text_input(key="new_task_name").input("Sweep")
+    next(button for button in at.button if button.label == "Add task").click().run()
+
+    exported = []
+    worker = threading.Thread(target=lambda: exported.append(deferred[-1]()))
+    worker.start()
+    worker.join()
+    assert exported and "Sweep" in exported[0]
@@ -0,0 +1,37 @@
+from datetime import date
+
+from analytics import category_completion
+from archive import ArchivedStorage
+from storage import get_storage
+
+JANUARY = (date(2026, 1, 1), date(2026, 1, 31))
+
+def open_store(folder):
+    return ArchivedStorage(get_storage("csv", folder), folder, max_age_days=0).open("u")
+
+def add(store, name, day, completed):
+    store.add({"Task": name, "Category": "Home", "Due Date": f"01-{day:02d}-2026", "Priority": "< 15 Minutes", "Completed": completed})
+
+def totals(store):
+    days = store.workload_between(*JANUARY)
+    return int(days["tasks"].sum()), int(days["done"].sum()), int(days["minutes"].sum())
+
+
+def test_workload_and_categories_count_archived_tasks(tmp_path):
+    store = open_store(tmp_path)
+    add(store, "Sweep", 5, True)
+    add(store, "Dust", 6, False)
+    assert store.archive_before(date(2026, 1, 10)) == 1
+    assert len(store) == 1
+    assert totals(store) == (2, 1, 20)
+
+    # Archiving again updates the loaded rollups in place
+    add(store, "Mop", 7, True)
+    assert store.archive_before(date(2026, 1, 10)) == 1
+    assert totals(store) == (3, 2, 30)
+    assert totals(open_store(tmp_path)) == (3, 2, 30)
+
+    (home,) = store.archived_categories()
+    assert (home.name, home.total, home.open) == ("Home", 2, 0)
+    table = category_completion(store.category_overview(), store.archived_categories())
+    assert table.loc["Home"].tolist() == [3, 2, 0.667]
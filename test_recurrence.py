@@ -0,0 +1,57 @@
+import io
+from datetime import date
+
+import pytest
+
+from recurrence import RecurringStorage
+from storage import STORAGE_BACKENDS, get_storage
+from task_io import import_tasks
+
+JANUARY = (date(2026, 1, 1), date(2026, 1, 31))
+
+ICS = "\r\n".join([
+    "BEGIN:VCALENDAR",
+    "BEGIN:VTODO",
+    "UID:abc123@google.com",
+    "SUMMARY:Imported",
+    "DUE;VALUE=DATE:20260105",
+    "END:VTODO",
+    "END:VCALENDAR",
+]) + "\r\n"
+
+def open_store(folder, backend):
+    return RecurringStorage(get_storage(backend, folder), folder).open("u")
+
+def key_of(store, name):
+    tasks = store.tasks_between(*JANUARY)
+    return tasks.index[tasks["Task"] == name][0]
+
+
+@pytest.mark.parametrize("backend", sorted(STORAGE_BACKENDS))
+def test_imported_ids_with_at_sign_are_not_occurrences(tmp_path, backend):
+    store = open_store(tmp_path, backend)
+    assert import_tasks(store, io.StringIO(ICS), "ics") == (1, 0)
+    store.set_completed(key_of(store, "Imported"), True)
+    assert store.tasks_between(*JANUARY)["Completed"].tolist() == [True]
+    store.delete(key_of(store, "Imported"))
+    assert store.tasks_between(*JANUARY).empty
+
+def test_occurrences_are_ticked_off_and_deleted_on_their_rule(tmp_path):
+    store = open_store(tmp_path, "csv")
+    store.add_recurring({"Task": "Water plants", "Due Date": "01-05-2026"}, "FREQ=WEEKLY")
+    first, second = store.tasks_between(*JANUARY).index[:2]
+    store.set_completed(first, True)
+    store.delete(second)
+
+    reopened = open_store(tmp_path, "csv")
+    tasks = reopened.tasks_between(*JANUARY)
+    assert len(tasks) == 3
+    assert tasks.loc[first, "Completed"] and second not in tasks.index
+
+def test_category_overview_lists_rules_after_own_tasks(tmp_path):
+    store = open_store(tmp_path, "csv")
+    store.add({"Task": "Sweep", "Category": "Home", "Due Date": "01-05-2026"})
+    store.add_recurring({"Task": "Water plants", "Category": "Home", "Due Date": "01-05-2026"}, "FREQ=WEEKLY")
+    (home,) = store.category_overview()
+    assert (home.total, home.open, len(home.tasks)) == (2, 2, 2)
+    assert home.tasks[0:25] == ["Sweep", "Water plants (repeats)"]
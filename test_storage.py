@@ -0,0 +1,106 @@
+from datetime import date
+
+import io
+
+import pandas as pd
+import pytest
+
+from storage import STORAGE_BACKENDS, BackgroundWriter, TaskCache, get_storage
+from task_io import import_tasks, iter_export
+
+JANUARY = (date(2026, 1, 1), date(2026, 1, 31))
+
+def seed(folder, backend, names):
+    get_storage(backend, folder).save("u", pd.DataFrame({
+        "Task": names,
+        "Category": "Home",
+        "Due Date": "01-05-2026",
+        "Priority": "< 15 Minutes",
+        "Completed": False,
+        "Description": "",
+    }))
+
+def key_of(store, name):
+    tasks = store.tasks_between(*JANUARY)
+    return tasks.index[tasks["Task"] == name][0]
+
+def stored(folder, backend):
+    tasks = get_storage(backend, folder).load("u")
+    return sorted(tasks["Task"]), sorted(tasks.loc[tasks["Completed"].fillna(False).astype(bool), "Task"])
+
+
+## Two writers on one folder
+# Each TaskCache stands for an app process with its own storage object; both
+# stores are opened before either writes, so every later write conflicts.
+@pytest.mark.parametrize("backend", sorted(STORAGE_BACKENDS))
+def test_two_writers_keep_both_changes(tmp_path, backend):
+    seed(tmp_path, backend, ["x", "y", "z"])
+    a, b = TaskCache(get_storage(backend, tmp_path)), TaskCache(get_storage(backend, tmp_path))
+    store_a, store_b = a.get("u"), b.get("u")
+
+    store_a.add({"Task": "fromA", "Due Date": "01-06-2026"})
+    store_b.delete(key_of(store_b, "x"))
+    # store_b is behind the file now; its next writes must still merge
+    store_b.add({"Task": "fromB", "Due Date": "01-07-2026"})
+    store_b.set_completed(key_of(store_b, "y"), True)
+    store_a.delete(key_of(store_a, "z"))
+
+    assert stored(tmp_path, backend) == (["fromA", "fromB", "y"], ["y"])
+    assert sorted(b.get("u").tasks["Task"]) == ["fromA", "fromB", "y"]
+
+@pytest.mark.parametrize("backend", sorted(STORAGE_BACKENDS))
+def test_two_background_writers_keep_both_changes(tmp_path, backend):
+    seed(tmp_path, backend, ["x", "y"])
+    writers = [BackgroundWriter(get_storage(backend, tmp_path), delay=0) for _ in range(2)]
+    try:
+        store_a, store_b = (TaskCache(writer).get("u") for writer in writers)
+        store_a.add({"Task": "fromA", "Due Date": "01-06-2026"})
+        writers[0].flush()
+        store_b.delete(key_of(store_b, "x"))
+        store_b.add({"Task": "fromB", "Due Date": "01-07-2026"})
+        for writer in writers:
+            assert writer.flush(timeout=10)
+    finally:
+        for writer in writers:
+            writer.close()
+    assert stored(tmp_path, backend)[0] == ["fromA", "fromB", "y"]
+
+
+## Imports
+@pytest.mark.parametrize("backend", sorted(STORAGE_BACKENDS))
+def test_importing_an_export_twice_adds_nothing(tmp_path, backend):
+    # The export comes from another backend, with IDs this one didn't make
+    seed(tmp_path / "csv", "csv", ["x", "y"])
+    exported = "".join(iter_export(get_storage("csv", tmp_path / "csv").load("u"), "csv"))
+    store = get_storage(backend, tmp_path).open("v")
+    assert import_tasks(store, io.StringIO(exported), "csv") == (2, 0)
+    assert import_tasks(store, io.StringIO(exported), "csv") == (0, 0)
+    assert len(store) == 2
+
+@pytest.mark.parametrize("backend", sorted(STORAGE_BACKENDS))
+def test_reimporting_own_export_adds_nothing(tmp_path, backend):
+    seed(tmp_path, backend, ["x", "y"])
+    store = get_storage(backend, tmp_path).open("u")
+    exported = "".join(iter_export(store.tasks, "csv"))
+    assert import_tasks(store, io.StringIO(exported), "csv") == (0, 0)
+    assert len(store) == 2
+
+
+## Journal crash recovery
+def test_journal_keeps_records_after_torn_line(tmp_path):
+    seed(tmp_path, "journal", ["before"])
+    journal = tmp_path / "tasks_u.journal"
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "task": {"Task": "tor')
+
+    store = get_storage("journal", tmp_path).open("u")
+    store.add({"Task": "after1"})
+    # Someone else crashes mid-append after we loaded
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"op": "delete", "i')
+    store.add({"Task": "after2"})
+
+    assert stored(tmp_path, "journal")[0] == ["after1", "after2", "before"]
+    storage = get_storage("journal", tmp_path)
+    storage.write("u", storage.load("u"))
+    assert stored(tmp_path, "journal")[0] == ["after1", "after2", "before"]
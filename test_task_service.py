@@ -0,0 +1,53 @@
+import threading
+from datetime import date
+
+import pytest
+
+from storage import get_storage
+from task_service import PooledHTTPServer, RemoteStorage, TaskService
+
+JANUARY = (date(2026, 1, 1), date(2026, 1, 31))
+
+@pytest.fixture
+def remote(tmp_path):
+    service = TaskService(get_storage("csv", tmp_path), tmp_path)
+    server = PooledHTTPServer(("127.0.0.1", 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield RemoteStorage(f"http://127.0.0.1:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def counted(storage):
+    actions = []
+    request = storage.request
+    def counting(user_id, action, body=None):
+        actions.append(action)
+        return request(user_id, action, body)
+    storage.request = counting
+    return actions
+
+
+@pytest.mark.parametrize("user_id", ["..", "../x", ".hidden", "a..b", "a\\b"])
+def test_invalid_user_ids_are_refused(remote, user_id):
+    with pytest.raises(ValueError, match="Invalid user id"):
+        remote.request(user_id, "version")
+
+def test_change_and_rerun_reads_share_one_request(remote):
+    store = remote.open("u")
+    store.add({"Task": "Sweep", "Due Date": "01-05-2026"})
+    key = store.tasks_between(*JANUARY).index[0]
+    store.count_on(date(2026, 1, 5))
+
+    actions = counted(remote)
+    store.set_completed(key, True)
+    assert not store.is_stale()
+    assert store.tasks_between(*JANUARY)["Completed"].tolist() == [True]
+    assert store.count_on(date(2026, 1, 5)) == 1
+    assert actions == ["changes"]
+
+def test_queued_changes_are_sent_on_flush(remote):
+    remote.open("u").add({"Task": "Sweep", "Due Date": "01-05-2026"})
+    remote.flush()
+    assert len(remote.open("u")) == 1
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import users
+from storage import file_stamp, get_storage
+from users import UserRegistry
+
+@pytest.fixture
+def registry(tmp_path):
+    # One list saved by the old app under "bob_pw1"
+    get_storage("csv", tmp_path).save("bob_pw1", pd.DataFrame({
+        "Task": ["old"],
+        "Category": "Home",
+        "Due Date": "01-05-2026",
+        "Priority": "< 15 Minutes",
+        "Completed": False,
+        "Description": "",
+    }))
+    registry = UserRegistry(tmp_path / "users.json")
+    assert registry.migrate(tmp_path) == 1
+    return registry
+
+
+## Logging in
+def test_wrong_password_is_refused(registry):
+    key = registry.login("Ann", "secret")
+    assert key is not None
+    assert registry.login("ann", "secret") == key
+    assert registry.login("Ann", "guess") is None
+
+def test_legacy_list_is_claimed_by_its_password(registry, tmp_path):
+    key = registry.login("bob", "pw1")
+    assert key is not None and key != "bob_pw1"
+    assert get_storage("csv", tmp_path).load(key)["Task"].tolist() == ["old"]
+    assert registry.login("bob", "pw1") == key
+
+def test_legacy_name_is_not_registered_by_another_password(registry):
+    assert registry.login("bob", "guess") is None
+    assert "bob" not in registry.user_keys()
+    assert registry.login("bob", "pw1") is not None
+
+
+## Sessions
+def test_session_token_works_once(registry, tmp_path):
+    key = registry.login("ann", "secret")
+    token = registry.start_session("ann")
+    stamp = file_stamp(tmp_path / "users.json")
+
+    name, resumed_key, new_token = registry.resume(token)
+    assert (name, resumed_key) == ("ann", key) and new_token != token
+    assert registry.resume(token) is None
+    assert registry.resume(new_token)[:2] == ("ann", key)
+    # Sessions don't touch the registry file
+    assert file_stamp(tmp_path / "users.json") == stamp
+
+def test_expired_session_is_refused(registry, monkeypatch):
+    registry.login("ann", "secret")
+    monkeypatch.setattr(users, "SESSION_SECONDS", -1)
+    assert registry.resume(registry.start_session("ann")) is None
+
+def test_ended_session_is_refused(registry):
+    registry.login("ann", "secret")
+    token = registry.start_session("ann")
+    registry.end_session(token)
+    assert registry.resume(token) is None
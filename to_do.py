@@ -1,40 +1,207 @@
 import streamlit as st
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
+import atexit
 import calendar
+import os
 from pathlib import Path
+from analytics import HEATMAP_CSS, by_week, category_completion, overdue, render_heatmap
+from archive import ArchivedStorage
+from calendar_view import CALENDAR_CSS, render_month
+from profiling import RerunTimer
+from recurrence import REPEAT_PRESETS, RecurringStorage
+from search import merge_hits
+from storage import BackgroundWriter, TaskCache, get_storage
+from task_io import FORMATS, detect_format, import_tasks, iter_export
+from task_service import RemoteStorage
+from users import UserRegistry
 
 st.set_page_config(page_title="To Do", layout="wide")
 
+## Debug timing (TODO_DEBUG=1 shows per-section timings under the page)
+DEBUG = os.environ.get("TODO_DEBUG") == "1"
+PROFILE_FOLDER = Path("profiles")
+timer = RerunTimer(DEBUG)
+if DEBUG and st.session_state.pop("profile_rerun", False):
+    timer.start_profile()
+
 #####################################
 
 ## File Setup
 DATA_FOLDER = Path("user_tasks")
-DATA_FOLDER.mkdir(exist_ok=True)
+# "csv" rewrites tasks_<user_id>.csv on every change, "journal" appends to a log,
+# "arrow" keeps typed columnar files, "partitioned" keeps one file per due month,
+# "sqlite" keeps every user in user_tasks/tasks.db
+STORAGE_BACKEND = os.environ.get("TODO_STORAGE", "csv")
+# TODO_BACKGROUND_WRITES=1 saves changes on a writer thread instead of inside the rerun
+BACKGROUND_WRITES = os.environ.get("TODO_BACKGROUND_WRITES") == "1"
+# TODO_SERVICE_URL=http://host:port keeps tasks in a task_service.py process
+# shared by every app replica, instead of reading user_tasks/ here
+SERVICE_URL = os.environ.get("TODO_SERVICE_URL")
+# Completed tasks due more than this many days ago move to a compressed
+# per-user archive when the user's tasks are loaded (0 keeps them all live)
+ARCHIVE_AFTER_DAYS = int(os.environ.get("TODO_ARCHIVE_AFTER_DAYS", "90"))
+# Longest day or category list shown at once, longer ones get a page picker
+PAGE_SIZE = int(os.environ.get("TODO_PAGE_SIZE", "25"))
 
 ## Helper functions 
-def load_tasks(data_file):
-    if data_file.exists():
-        return pd.read_csv(data_file)
-    return pd.DataFrame(columns=["Task", "Category", "Due Date", "Priority", "Completed"])
-
-def save_tasks(df, data_file):
-    df.to_csv(data_file, index=False)
-
-## Colors for Task Time 
-priority_colors = {
-    "> 45 Minutes": "#832120",
-    "15-45 Minutes": "#CE713B",
-    "< 15 Minutes": "#FABC75"
-}
+@st.cache_resource
+def load_task_cache(backend, folder, background_writes, archive_after_days, service_url=None):
+    # One backend and task cache per server process, shared by every session
+    if service_url:
+        # The service keeps repeating tasks and the archive too
+        storage = RemoteStorage(service_url)
+        # Send changes still queued for the service before the process exits
+        atexit.register(storage.flush)
+        return TaskCache(storage)
+    storage = get_storage(backend, folder)
+    if background_writes:
+        storage = BackgroundWriter(storage)
+        # Drain queued writes before the server process exits
+        atexit.register(storage.close)
+    storage = ArchivedStorage(storage, folder, archive_after_days)
+    # Repeating tasks are kept as rules next to the tasks and expanded on read
+    return TaskCache(RecurringStorage(storage, folder))
+
+task_cache = load_task_cache(STORAGE_BACKEND, DATA_FOLDER, BACKGROUND_WRITES, ARCHIVE_AFTER_DAYS, SERVICE_URL)
+
+@st.cache_resource
+def load_user_registry(folder, migrate):
+    registry = UserRegistry(folder / "users.json")
+    if migrate:
+        # Tasks saved under the old "<name>_<password>" ids move to registry keys
+        registry.migrate(folder)
+    return registry
+
+# With a service the tasks live elsewhere; migrate them there with users.py
+user_registry = load_user_registry(DATA_FOLDER, not SERVICE_URL)
+
+def page_bounds(total, key):
+    # Only the visible page is fetched and drawn, however long the list is
+    pages = max(1, -(-total // PAGE_SIZE))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=key)
+    start = (page - 1) * PAGE_SIZE
+    return start, start + PAGE_SIZE
+
+def log_in(user_name, user_key):
+    st.query_params["session"] = user_registry.start_session(user_name)
+    st.session_state.update(authenticated=True, user_name=user_name, user_key=user_key)
+    st.session_state.pop("claim_list", None)
+    st.rerun()
+
+def log_out():
+    user_registry.end_session(st.query_params.get("session"))
+    st.query_params.pop("session", None)
+    st.session_state.update(authenticated=False, user_name="", user_key="")
+
+@st.cache_data(max_entries=256)
+def render_month_html(user_id, year, month, version, include_archived, _task_store):
+    # Keyed on the data version, so a month is only re-rendered after a change
+    return render_month(_task_store, year, month, include_archived)
+
+@st.cache_data(max_entries=256)
+def year_workload(user_id, year, version, _task_store):
+    # The per-day totals come from the store's and the archive's workload
+    # rollups; only the heatmap is built here, once per data version
+    days = _task_store.workload_between(date(year, 1, 1), date(year, 12, 31))
+    return days, render_heatmap(days)
+
+@st.cache_data(max_entries=256)
+def overdue_totals(user_id, today, version, _task_store):
+    # Open tasks due before today in any year, not just the one on show
+    first = _task_store.first_due_date()
+    if first is None or first >= today:
+        return 0, 0
+    return overdue(_task_store.workload_between(first, today - timedelta(days=1)), today)
+
+## Change callbacks
+# Each page region below is a fragment that reruns on its own. A change to
+# the tasks reruns just the regions that show tasks (plus the one it came
+# from) instead of the whole script, so the login checks, the add form and
+# the styles are left alone.
+DATA_FRAGMENTS = ["calendar", "day_list", "categories", "search", "workload"]
+
+def user_store():
+    # Looked up on every use: another session may have reloaded the store
+    return task_cache.get(st.session_state.user_key)
+
+def toggle_task(key, widget_key):
+    user_store().set_completed(key, st.session_state[widget_key])
+    st.rerun(DATA_FRAGMENTS)
+
+def delete_task(key):
+    user_store().delete(key)
+    st.rerun(DATA_FRAGMENTS)
+
+def flip_month(step):
+    months = st.session_state.cal_year * 12 + st.session_state.cal_month - 1 + step
+    st.session_state.cal_year, st.session_state.cal_month = divmod(months, 12)
+    st.session_state.cal_month += 1
+
+def show_day(day):
+    # Points the calendar and the day list at day (search result buttons)
+    st.session_state.cal_month, st.session_state.cal_year = day.month, day.year
+    st.session_state.selected_day = day
+    st.rerun(["calendar", "day_list"])
+
+def add_task():
+    form = st.session_state
+    if not form.new_task_name:
+        return
+    new_task = {
+        "Task": form.new_task_name,
+        "Category": form.new_task_category,
+        "Due Date": form.new_task_due.strftime("%m-%d-%Y"),
+        "Priority": form.new_task_priority,
+        "Completed": False,
+        "Description": form.new_task_description
+    }
+    if form.new_task_repeats == "Never":
+        user_store().add(new_task)
+        form.add_message = ("success", f"Added: {new_task['Task']}")
+    else:
+        try:
+            user_store().add_recurring(new_task, REPEAT_PRESETS.get(form.new_task_repeats, form.new_task_rule))
+            form.add_message = ("success", f"Added repeating task: {new_task['Task']}")
+        except ValueError as e:
+            form.add_message = ("error", f"Couldn't read the repeat rule: {e}")
+    st.rerun(["add_task", *DATA_FRAGMENTS])
+
+def stop_rule(rule_id):
+    user_store().remove_recurring(rule_id)
+    st.rerun(["add_task", *DATA_FRAGMENTS])
+
+def import_upload():
+    upload = st.session_state.import_file
+    if upload is None:
+        return
+    try:
+        added, rejected = import_tasks(user_store(), upload, detect_format(upload.name))
+    except (ValueError, pd.errors.ParserError, UnicodeDecodeError) as e:
+        # Malformed JSON or CSV, or not UTF-8 text
+        st.session_state.import_message = ("error", f"Couldn't read {upload.name}: {e}")
+    else:
+        message = f"Imported {added} task(s)" + (f", skipped {rejected} invalid row(s)" if rejected else "")
+        st.session_state.import_message = ("success", message)
+    st.rerun(["import_export", *DATA_FRAGMENTS])
 
 ## Login Page 
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
 if "user_name" not in st.session_state:
     st.session_state.user_name = ""
-if "secret_key" not in st.session_state:
-    st.session_state.secret_key = ""
+if "user_key" not in st.session_state:
+    st.session_state.user_key = ""
+
+if not st.session_state.authenticated:
+    # A returning browser brings its session token in the URL and skips the
+    # form; the token is swapped for a fresh one each time
+    session = user_registry.resume(st.query_params.get("session"))
+    if session:
+        st.session_state.user_name, st.session_state.user_key, st.query_params["session"] = session
+        st.session_state.authenticated = True
 
 if not st.session_state.authenticated:
     st.markdown(f"<h1>Much To Do About Nothing!</h1>", unsafe_allow_html=True)
@@ -47,194 +214,217 @@ if not st.session_state.authenticated:
 
         if submitted:
             if user_name and secret_key:
-                st.session_state.user_name = user_name
-                st.session_state.secret_key = secret_key
-                st.session_state.authenticated = True
-                st.rerun()
+                user_key = user_registry.login(user_name, secret_key)
+                if user_key is not None:
+                    log_in(user_name, user_key)
+                elif user_registry.unclaimed_list(user_name, secret_key):
+                    st.session_state.claim_list = (user_name, secret_key)
+                else:
+                    st.error("Wrong password for that username.")
             else:
                 st.warning("Please enter both a name and secret key to continue.")
+
+    if "claim_list" in st.session_state:
+        # Someone else registered the name first; the old app kept a list per
+        # name and password, and this password opens one of them
+        old_name, secret_key = st.session_state.claim_list
+        st.info(
+            f"The username {old_name} is taken, but your password opens a list saved under it "
+            "before accounts existed. Choose a new username to keep that list; your password stays the same."
+        )
+        with st.form("claim_form"):
+            new_name = st.text_input("New username")
+            if st.form_submit_button("Keep my list under this name") and new_name:
+                user_key = user_registry.claim_list(old_name, secret_key, new_name)
+                if user_key is None:
+                    st.error("That username is taken too, please pick another.")
+                else:
+                    log_in(new_name, user_key)
     st.stop()
 
 ## After login 
 user_name = st.session_state.user_name
-secret_key = st.session_state.secret_key
-user_id = f"{user_name.lower().replace(' ', '_')}_{secret_key}"
-DATA_FILE = DATA_FOLDER / f"tasks_{user_id}.csv"
+# Tasks are stored under the registry's key for the user, never the password
+user_id = st.session_state.user_key
 
-## Load tasks
-if "tasks" not in st.session_state:
-    st.session_state.tasks = load_tasks(DATA_FILE)
+timer.lap("login")
 
-tasks = st.session_state.tasks.copy()
+## Load tasks (shared with this user's other sessions)
+task_store = task_cache.get(user_id)
+timer.lap("load")
 
 #####################################
 
-## Title 
-st.markdown(f"<h1>Much To Do About Nothing!</h1>", unsafe_allow_html=True)
-
 ## Sidebar: Add task 
-with st.sidebar:
+@st.fragment(key="add_task")
+def add_task_form():
     st.header("+ Add Task")
     with st.form("new_task_form", clear_on_submit=True):
-        task = st.text_input("Task name")
-        category = st.text_input("Category")
-        due_date = st.date_input("Due date", value=date.today())
-        priority = st.selectbox("Time", ["> 45 Minutes", "15-45 Minutes", "< 15 Minutes"])
-        description = st.text_area("Description (optional)")   
-        submitted = st.form_submit_button("Add task")
-
-        if submitted and task:
-            due_date_str = due_date.strftime("%m-%d-%Y")
-            new_task = {
-                "Task": task,
-                "Category": category,
-                "Due Date": due_date_str,
-                "Priority": priority,
-                "Completed": False,
-                "Description": description  
-            }
-            st.session_state.tasks = pd.concat(
-                [st.session_state.tasks, pd.DataFrame([new_task])],
-                ignore_index=True
-            )
-            save_tasks(st.session_state.tasks, DATA_FILE)
-            st.success(f"Added: {task}")
+        st.text_input("Task name", key="new_task_name")
+        st.text_input("Category", key="new_task_category")
+        st.date_input("Due date", value=date.today(), key="new_task_due")
+        st.selectbox("Time", ["> 45 Minutes", "15-45 Minutes", "< 15 Minutes"], key="new_task_priority")
+        st.text_area("Description (optional)", key="new_task_description")
+        st.selectbox("Repeats", ["Never", *REPEAT_PRESETS, "Custom"], key="new_task_repeats")
+        st.text_input("Custom rule (used with Custom)", placeholder="FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH", key="new_task_rule")
+        st.form_submit_button("Add task", on_click=add_task)
+    if "add_message" in st.session_state:
+        kind, message = st.session_state.pop("add_message")
+        getattr(st, kind)(message)
+
+    rules = user_store().recurring_rules()
+    if rules:
+        with st.expander("Repeating tasks"):
+            for rule in rules:
+                col1, col2 = st.columns([4, 1])
+                col1.markdown(f"{rule['Task']}  \n`{rule['RRULE']}` from {rule['Start']}")
+                col2.button("Stop", key=f"stop_rule_{rule['ID']}", on_click=stop_rule, args=(rule["ID"],))
+
+
+## Sidebar: Search (answered from the store's inverted index)
+@st.fragment(key="search")
+def search_box():
+    query = st.text_input("Search tasks", placeholder="e.g. groc milk")
+    # The archive is only read (and indexed) once this is switched on
+    search_archived = st.toggle("Include archived", key="search_archived")
+    if query:
+        task_store = user_store()
+        hits = task_store.search(query)
+        if search_archived:
+            hits = merge_hits(20, hits, task_store.search_archived(query))
+        if not hits:
+            st.caption("No matching tasks.")
+        for hit in hits:
+            col1, col2 = st.columns([4, 1])
+            name = f"~~{hit.task}~~" if hit.completed else hit.task
+            due = hit.due.strftime("%m-%d-%Y") if hit.due is not None else "no due date"
+            category = hit.category if isinstance(hit.category, str) else ""
+            col1.markdown(f"{name}  \n{category} · {due}")
+            if hit.due is not None and date(date.today().year, 1, 1) <= hit.due.date() <= date(date.today().year + 5, 12, 31):
+                col2.button("Show", key=f"search_show_{hit.id}", on_click=show_day, args=(hit.due.date(),))
+
+
+## Sidebar: Bulk import / export
+@st.fragment(key="import_export")
+def import_export():
+    with st.expander("Import / Export"):
+        upload = st.file_uploader("Import tasks", type=["csv", "json", "jsonl", "ics"], key="import_file")
+        if upload is not None:
+            st.button("Import", on_click=import_upload)
+        if "import_message" in st.session_state:
+            kind, message = st.session_state.pop("import_message")
+            getattr(st, kind)(message)
+        export_format = st.selectbox("Export format", FORMATS)
+        # The file is only built when the button is clicked, on a thread
+        # without the session, so the store is looked up here
+        store = user_store()
+        st.download_button(
+            "Export tasks",
+            data=lambda: "".join(iter_export(store.tasks, export_format)),
+            file_name=f"tasks.{export_format}",
+            on_click="ignore",
+        )
 
 
 ## Sidebar: Category overview 
-st.sidebar.header("Category Overview")
-
-if not tasks.empty:
-    categories = sorted(tasks["Category"].dropna().unique().tolist())
-    active_categories = []
-    inactive_categories = []
-
-    for cat in categories:
-        cat_tasks = tasks[tasks["Category"] == cat]
-        if not cat_tasks.empty:
-            if cat_tasks["Completed"].all():
-                inactive_categories.append(cat)
-            else:
-                active_categories.append(cat)
-
-    st.sidebar.subheader("Active")
+@st.fragment(key="categories")
+def category_overview():
+    st.header("Category Overview")
+    task_store = user_store()
+    if not len(task_store):
+        st.info("No tasks added yet.")
+        return
+
+    # Counts and names come from the store's rollup, no scan of the tasks
+    categories = task_store.category_overview()
+    active_categories = [cat for cat in categories if cat.open]
+    inactive_categories = [cat for cat in categories if not cat.open]
+
+    st.subheader("Active")
     if active_categories:
         for cat in active_categories:
             # Category name now appears as the label of the expander
-            with st.sidebar.expander(f"### {cat}", expanded=False):
-                cat_tasks = tasks[tasks["Category"] == cat]
-                for i, row in cat_tasks.iterrows():
-                    st.markdown(f"- {row['Task']}")
+            with st.expander(f"### {cat.name}", expanded=False):
+                start, stop = page_bounds(cat.total, f"cat_page_{cat.name}")
+                for name in cat.tasks[start:stop]:
+                    st.markdown(f"- {name}")
     else:
-        st.sidebar.info("No active tasks!")
+        st.info("No active tasks!")
 
-    st.sidebar.subheader("Inactive")
+    st.subheader("Inactive")
     if inactive_categories:
         for cat in inactive_categories:
-            with st.sidebar.expander(f"### {cat}", expanded=False):
-                cat_tasks = tasks[tasks["Category"] == cat]
-                for i, row in cat_tasks.iterrows():
-                    st.markdown(f"- {row['Task']}")
+            with st.expander(f"### {cat.name}", expanded=False):
+                start, stop = page_bounds(cat.total, f"cat_page_{cat.name}")
+                for name in cat.tasks[start:stop]:
+                    st.markdown(f"- {name}")
     else:
-        st.sidebar.info("No inactive categories.")
-else:
-    st.sidebar.info("No tasks added yet.")
+        st.info("No inactive categories.")
 
-## Calendar view 
-calendar_tasks = st.session_state.tasks.copy()
-calendar_tasks["Due Date"] = pd.to_datetime(calendar_tasks["Due Date"], errors='coerce')
 
-today = date.today()
-
-## Initialize session state for month/year 
-if "cal_month" not in st.session_state:
-    st.session_state.cal_month = today.month
-if "cal_year" not in st.session_state:
-    st.session_state.cal_year = today.year
-
-col1, col2, col3 = st.columns([1, 2, 1])
-
-prev_clicked = col1.button("←")
-next_clicked = col3.button("→")
+## Calendar view 
+@st.fragment(key="calendar")
+def calendar_view():
+    today = date.today()
 
-if prev_clicked:
-    if st.session_state.cal_month == 1:
-        st.session_state.cal_month = 12
-        st.session_state.cal_year -= 1
-    else:
-        st.session_state.cal_month -= 1
+    ## Initialize session state for month/year 
+    if "cal_month" not in st.session_state:
+        st.session_state.cal_month = today.month
+    if "cal_year" not in st.session_state:
+        st.session_state.cal_year = today.year
 
-if next_clicked:
-    if st.session_state.cal_month == 12:
-        st.session_state.cal_month = 1
-        st.session_state.cal_year += 1
-    else:
-        st.session_state.cal_month += 1
+    col1, col2, col3 = st.columns([1, 2, 1])
+    col1.button("←", on_click=flip_month, args=(-1,))
+    col3.button("→", on_click=flip_month, args=(1,))
 
-with col2:
-    st.markdown(
-        f"### {calendar.month_name[st.session_state.cal_month]} {st.session_state.cal_year}",
-        unsafe_allow_html=True
-    )
+    with col2:
+        st.markdown(
+            f"### {calendar.month_name[st.session_state.cal_month]} {st.session_state.cal_year}",
+            unsafe_allow_html=True
+        )
 
+    month_num = st.session_state.cal_month
+    year = st.session_state.cal_year
 
-month_num = st.session_state.cal_month
-year = st.session_state.cal_year
-
-cal = calendar.Calendar(firstweekday=6)
-month_days = cal.monthdatescalendar(year, month_num)
-
-html_calendar = "<table border='1' style='border-collapse: collapse; width: 100%; text-align: center; table-layout: fixed;'>"
-html_calendar += "<tr>" + "".join(f"<th>{day}</th>" for day in ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]) + "</tr>"
-
-all_dates = []
-for week in month_days:
-    html_calendar += "<tr>"
-    for day in week:
-        all_dates.append(day)
-        day_tasks = calendar_tasks[calendar_tasks["Due Date"].dt.date == day]
-        if day.month != month_num:
-            html_calendar += "<td style='background-color:#f0f0f0; color:#999;'> </td>"
-        elif not day_tasks.empty:
-            tasks_text = ""
-            for _, row in day_tasks.iterrows():
-                color = priority_colors.get(row["Priority"], "#ffffff")
-                if row["Completed"]:
-                    tasks_text += f"<div style='background-color:#d3d3d3; color:#888; margin:2px; padding:2px; border-radius:4px; text-decoration:line-through; word-break: break-word;'>{row['Task']}</div>"
-                else:
-                    tasks_text += f"<div style='background-color:{color}; color:white; margin:2px; padding:2px; border-radius:4px; word-break: break-word;'>{row['Task']}</div>"
-            html_calendar += f"<td style='vertical-align: top; padding:2px;'><strong>{day.day}</strong><br>{tasks_text}</td>"
-        else:
-            html_calendar += f"<td style='vertical-align: top; padding:2px;'>{day.day}</td>"
-    html_calendar += "</tr>"
-html_calendar += "</table>"
+    task_store = user_store()
+    show_archived = st.toggle("Include archived", key="calendar_archived")
+    html_calendar = render_month_html(user_id, year, month_num, task_store.version, show_archived, task_store)
+    st.markdown(html_calendar, unsafe_allow_html=True)
 
-st.markdown(html_calendar, unsafe_allow_html=True)
 
 ## Interactive day selection (replace dropdown with mini calendar) 
-selected_day = st.date_input(
-    "Select a day",
-    value=date.today(),
-    min_value=date(today.year, 1, 1),
-    max_value=date(today.year + 5, 12, 31)
-)
+@st.fragment(key="day_list")
+def day_list():
+    today = date.today()
+    if "selected_day" not in st.session_state:
+        st.session_state.selected_day = today
+    selected_day = st.date_input(
+        "Select a day",
+        key="selected_day",
+        min_value=date(today.year, 1, 1),
+        max_value=date(today.year + 5, 12, 31)
+    )
 
-## Filter tasks for the selected day
-day_tasks = calendar_tasks[calendar_tasks["Due Date"].dt.date == selected_day]
+    ## Filter tasks for the selected day
+    task_store = user_store()
+    start, stop = page_bounds(task_store.count_on(selected_day), f"day_page_{selected_day}")
+    day_tasks = task_store.tasks_on(selected_day, start, stop)
 
-if not day_tasks.empty:
+    if day_tasks.empty:
+        st.info("Nothing to do!")
+        return
     for i, row in day_tasks.iterrows():
         col1, col2, col3 = st.columns([0.1, 0.75, 0.15])
 
         with col1:  
-            completed = st.checkbox(
-                "",
+            st.checkbox(
+                "Done",
+                label_visibility="collapsed",
                 value=row["Completed"],
-                key=f"main_completed_{i}"
+                key=f"main_completed_{i}",
+                on_change=toggle_task,
+                args=(i, f"main_completed_{i}")
             )
-            if completed != row["Completed"]:
-                st.session_state.tasks.at[i, "Completed"] = completed
-                save_tasks(st.session_state.tasks, DATA_FILE)
 
         with col2:  
             task_text = f"{row['Task']}"
@@ -243,13 +433,60 @@ if not day_tasks.empty:
             st.markdown(task_text)
 
         with col3:  
-            delete = st.button("X", key=f"main_delete_{i}")
-            if delete:
-                st.session_state.tasks = st.session_state.tasks.drop(i).reset_index(drop=True)
-                save_tasks(st.session_state.tasks, DATA_FILE)
-                st.rerun()
-else:
-    st.info("Nothing to do!")
+            st.button("X", key=f"main_delete_{i}", on_click=delete_task, args=(i,))
+
+
+## Workload analytics
+@st.fragment(key="workload")
+def workload_view():
+    # Nothing is read until this is switched on
+    if not st.toggle("Show workload", key="show_workload"):
+        return
+    today = date.today()
+    year = st.selectbox("Year", range(today.year - 2, today.year + 6), index=2, key="workload_year")
+    task_store = user_store()
+    days, heatmap = year_workload(user_id, year, task_store.version, task_store)
+    weeks = by_week(days)
+    late_tasks, late_minutes = overdue_totals(user_id, today, task_store.version, task_store)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric(f"Booked in {year}", f"{days['minutes'].sum() / 60:,.1f} h")
+    this_week = weeks.loc[weeks.index <= pd.Timestamp(today), "minutes"].iloc[-1] if year == today.year else 0
+    col2.metric("Booked this week", f"{this_week / 60:,.1f} h")
+    col3.metric("Overdue", late_tasks, help=f"{late_minutes} minutes booked for open tasks due before today")
+
+    st.markdown(heatmap, unsafe_allow_html=True)
+    st.caption("Minutes booked per week")
+    st.bar_chart(pd.DataFrame({
+        "done": weeks["done minutes"],
+        "open": weeks["minutes"] - weeks["done minutes"],
+    }))
+    st.caption("Completion by category")
+    st.dataframe(category_completion(task_store.category_overview(), task_store.archived_categories()))
+
+
+## Page layout
+# On a full rerun every fragment runs in place; after that each one reruns
+# by itself when its own widgets are used.
+st.markdown(f"<h1>Much To Do About Nothing!</h1>", unsafe_allow_html=True)
+
+with st.sidebar:
+    st.button("Log out", on_click=log_out)
+    add_task_form()
+    timer.lap("add form")
+    search_box()
+    timer.lap("search")
+    import_export()
+    timer.lap("import/export")
+    category_overview()
+    timer.lap("category overview")
+
+calendar_view()
+timer.lap("calendar")
+day_list()
+timer.lap("day list")
+workload_view()
+timer.lap("workload")
 
 #####################################
 
@@ -283,6 +520,10 @@ div[data-testid^="stButton"][data-testid*="delete_"] button:hover {
 </style>
 """, unsafe_allow_html=True)
 
+# Calendar Styling
+st.markdown(CALENDAR_CSS, unsafe_allow_html=True)
+st.markdown(HEATMAP_CSS, unsafe_allow_html=True)
+
 # Make Sidebar Headers Match Main Header
 st.markdown("""
 <style>
@@ -294,5 +535,17 @@ section[data-testid="stSidebar"] h3   /* Sidebar subheaders */ {
 }
 </style>
 """, unsafe_allow_html=True)
-
-
+timer.lap("styles")
+
+## Debug panel 
+if DEBUG:
+    profile_path = timer.stop_profile(PROFILE_FOLDER) if timer.profiler else None
+    timer.log(user=user_id, storage=STORAGE_BACKEND, tasks=len(task_store))
+    with st.expander(f"Debug: rerun took {timer.total() * 1e3:.1f} ms"):
+        st.table(pd.DataFrame(
+            [(name, round(seconds * 1e3, 2)) for name, seconds in timer.laps],
+            columns=["Section", "ms"]
+        ))
+        if profile_path:
+            st.caption(f"cProfile of this rerun written to {profile_path}")
+        st.button("Profile next rerun", on_click=lambda: st.session_state.update(profile_rerun=True))
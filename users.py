@@ -0,0 +1,263 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from storage import _write_durably, file_lock, file_stamp, rename_user_data, stored_user_ids
+
+## User registry
+# user_tasks/users.json maps each username to a salted scrypt hash of their
+# password and the opaque key their tasks are stored under, so a login is a
+# dict lookup plus one hash checked in constant time, and file names no
+# longer carry passwords. Changes re-read the file under its lock, like rule
+# files; reads reload it only when its stamp moved. Session tokens (kept as
+# SHA-256 digests) let a returning browser back in without the password;
+# each one works once and is swapped for a new one when used, since it
+# travels in the page URL. They live in a SQLite table next to the file
+# (users.sessions.db), so resuming a session writes one row instead of
+# rewriting the registry.
+SCRYPT_PARAMS = {"n": 2**14, "r": 8, "p": 1, "dklen": 32}
+SESSION_SECONDS = 7 * 24 * 3600
+
+def normalize_name(user_name):
+    # The form the old user ids used, so migrated accounts keep their names
+    return user_name.strip().lower().replace(" ", "_")
+
+def hash_secret(secret, salt):
+    return hashlib.scrypt(secret.encode(), salt=salt, **SCRYPT_PARAMS)
+
+def make_credential(secret):
+    salt = os.urandom(16)
+    return {"salt": salt.hex(), "hash": hash_secret(secret, salt).hex()}
+
+def check_credential(secret, credential):
+    expected = bytes.fromhex(credential["hash"])
+    return hmac.compare_digest(hash_secret(secret, bytes.fromhex(credential["salt"])), expected)
+
+def new_user_key():
+    return f"u{secrets.token_hex(8)}"
+
+def _token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class UserRegistry:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self._seen = False
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (digest TEXT PRIMARY KEY, user TEXT, expires REAL)")
+        if self._reload()["sessions"]:
+            # Sessions kept in users.json before the table
+            def move(data):
+                with self.connect() as conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO sessions VALUES (?, ?, ?)",
+                        [(digest, session["user"], session["expires"]) for digest, session in data["sessions"].items()],
+                    )
+                data["sessions"] = {}
+            self._change(move)
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path.with_suffix(".sessions.db"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self):
+        data = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+        for section in ("users", "legacy", "sessions"):
+            data.setdefault(section, {})
+        return data
+
+    def _reload(self):
+        # Another process may have registered someone since we last looked
+        with self.lock:
+            stamp = file_stamp(self.path)
+            if stamp != self._seen:
+                self.data, self._seen = self._read(), stamp
+            return self.data
+
+    def _change(self, update):
+        with self.lock, file_lock(self.path):
+            data = self._read()
+            result = update(data)
+            tmp = self.path.with_suffix(".json.tmp")
+            _write_durably(tmp, json.dumps(data))
+            os.replace(tmp, self.path)
+            self.data, self._seen = data, file_stamp(self.path)
+            return result
+
+    def __len__(self):
+        return len(self._reload()["users"])
+
+    def user_keys(self):
+        return {name: user["key"] for name, user in self._reload()["users"].items()}
+
+    ## Logging in
+    def login(self, user_name, secret):
+        # The user's storage key, or None for a wrong password. An unknown
+        # name is registered on the spot (claiming its migrated tasks if the
+        # password matches), as the app has always let anyone start a list.
+        # A name with migrated lists is only registered by one of their
+        # passwords, so a wrong guess can't take it from their owners.
+        name = normalize_name(user_name)
+        data = self._reload()
+        user = data["users"].get(name)
+        if user is not None:
+            return user["key"] if check_credential(secret, user) else None
+        claimed = self._legacy_entry(name, secret)
+        if claimed is None and data["legacy"].get(name):
+            return None
+        return self._register(name, secret, claimed)
+
+    def _legacy_entry(self, name, secret):
+        # Old user ids were "<name>_<password>", hashed as a whole
+        return next(
+            (entry for entry in self._reload()["legacy"].get(name, []) if check_credential(f"{name}_{secret}", entry)),
+            None,
+        )
+
+    def unclaimed_list(self, user_name, secret):
+        # The old app gave every (name, password) pair its own list, so a
+        # taken name can still have lists saved under other passwords. True
+        # when this password unlocks one; claim_list() moves it to a new name.
+        name = normalize_name(user_name)
+        return name in self._reload()["users"] and self._legacy_entry(name, secret) is not None
+
+    def claim_list(self, user_name, secret, new_user_name):
+        # Registers new_user_name with the same password for the old list
+        # user_name + secret unlocks. Returns its key, or None if the list
+        # is gone or the new name is taken.
+        entry = self._legacy_entry(normalize_name(user_name), secret)
+        new_name = normalize_name(new_user_name)
+        if entry is None or not new_name or new_name in self._reload()["users"]:
+            return None
+        key = self._register(new_name, secret, entry)
+        return key if key == entry["key"] else None
+
+    def _register(self, name, secret, claimed):
+        credential = make_credential(secret)
+
+        def register(data):
+            if name in data["users"]:
+                # Someone registered the name while we were hashing
+                return data["users"][name]["key"] if check_credential(secret, data["users"][name]) else None
+            key = claimed["key"] if claimed else new_user_key()
+            data["users"][name] = {**credential, "key": key}
+            if claimed:
+                # The same old id is listed under each way of splitting it
+                for candidate in list(data["legacy"]):
+                    entries = [entry for entry in data["legacy"][candidate] if entry["key"] != key]
+                    if entries:
+                        data["legacy"][candidate] = entries
+                    else:
+                        del data["legacy"][candidate]
+            return key
+        return self._change(register)
+
+    ## Sessions
+    def start_session(self, user_name):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+            conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?)", (_token_digest(token), normalize_name(user_name), now + SESSION_SECONDS)
+            )
+        return token
+
+    def resume(self, token):
+        # (username, storage key, new token) for a live session token, else
+        # None. The token is used up, so a leaked copy of an old URL (from
+        # history or a shared link) no longer logs anyone in.
+        if not token:
+            return None
+        digest, new_token, now = _token_digest(token), secrets.token_urlsafe(32), time.time()
+        with self.connect() as conn:
+            row = conn.execute("SELECT user FROM sessions WHERE digest = ? AND expires >= ?", (digest, now)).fetchone()
+            # Another tab may use the token between the two statements
+            if row is None or conn.execute("DELETE FROM sessions WHERE digest = ?", (digest,)).rowcount == 0:
+                return None
+            user = self._reload()["users"].get(row[0])
+            if user is None:
+                return None
+            conn.execute("INSERT INTO sessions VALUES (?, ?, ?)", (_token_digest(new_token), row[0], now + SESSION_SECONDS))
+        return row[0], user["key"], new_token
+
+    def end_session(self, token):
+        if token:
+            with self.connect() as conn:
+                conn.execute("DELETE FROM sessions WHERE digest = ?", (_token_digest(token),))
+
+    ## Migration
+    def taken_names(self):
+        # {username: old lists} for names an account was registered under
+        # while other passwords' lists under that name are still unclaimed
+        data = self._reload()
+        return {name: len(entries) for name, entries in data["legacy"].items() if name in data["users"]}
+
+    def migrate(self, folder):
+        # Moves every old "<name>_<password>" user's tasks to a new key and
+        # lists it under each name it could have been logged in with, so the
+        # first login with the right password claims it. The registry is
+        # saved before anything is moved; a rerun after a crash finds the
+        # entries already written and finishes the moves. Returns the number
+        # of users moved.
+        folder = Path(folder)
+        with self.lock, file_lock(self.path):
+            data = self._read()
+            known = {user["key"] for user in data["users"].values()}
+            known.update(entry["key"] for entries in data["legacy"].values() for entry in entries)
+            moves = []
+            for old_id in sorted(stored_user_ids(folder) - known):
+                parts = old_id.split("_")
+                names = [name for name in ("_".join(parts[:i]) for i in range(1, len(parts))) if name == name.lower()]
+                if not names:
+                    continue
+                entry = next(
+                    (entry for entry in data["legacy"].get(names[0], []) if check_credential(old_id, entry)), None
+                )
+                if entry is None:
+                    entry = {**make_credential(old_id), "key": new_user_key()}
+                    for name in names:
+                        data["legacy"].setdefault(name, []).append(entry)
+                moves.append((old_id, entry["key"]))
+            if moves:
+                self._change(lambda current: current.update(legacy=data["legacy"]))
+            for old_id, key in moves:
+                rename_user_data(folder, old_id, key)
+            return len(moves)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the user registry")
+    parser.add_argument("command", choices=["migrate", "list"])
+    parser.add_argument("--folder", default="user_tasks", help="where the tasks are stored")
+    parser.add_argument("--registry", help="default: users.json in --folder")
+    args = parser.parse_args()
+
+    registry = UserRegistry(args.registry or Path(args.folder) / "users.json")
+    if args.command == "migrate":
+        moved = registry.migrate(args.folder)
+        print(f"Moved {moved} user(s) to registry keys in {args.folder}")
+        taken = registry.taken_names()
+        if taken:
+            print("These usernames are registered, but old lists saved under them with other passwords are unclaimed.")
+            print("Logging in with the name and the list's old password offers to move the list to a new username:")
+            for name, lists in sorted(taken.items()):
+                print(f"{name}\t{lists} list(s)")
+    else:
+        for name, key in sorted(registry.user_keys().items()):
+            print(f"{name}\t{key}")